@@ -15,23 +15,26 @@ Dependencies:
    Must Have:
       git: Git-Tool is a wrapper of git
    Better To Have:
-      graphviz: Git-Tool needs this tool to show graphical hash tree via glsg
-      APScheduler: a python library, needed for periodically update your local repo
+      pygtk: Git-Tool shows the graphical hash tree of glsg with xdot.py (in support/), which needs pygtk
 
 Also:
    try `<command> --help' or `ghelp <command>' to get detailed help message for the command
+   run a command with GITTOOL_TIMING=1 to see where its start-up time goes
 """
-import os, re, sys, subprocess
-from optparse import OptionParser
-import pdb
+import os, sys
+if __name__ == '__main__':
+    #a resident server, if there is one, runs the command in a warm interpreter
+    import gitserver
+    gitserver.forward(sys.argv)
+import re, subprocess
 #GitTool private libs
 import gitcommand as git
+import gitserver
 from githelper import *
 
 """
 TODO: GitTool doesn't work in the shell environment of Emacs, fix it
 TODO: make use of git stash - we should invoke this command in background, when switching branches/updating local repo with uncommited changes.
-TODO: have a background thread running to optimize the repo, like doing 'git gc', at a specified time, we could do periodical fetch, too!
 TODO: to support partial commit of local changes
 TODO: provide a list of valid remote branches, when updating the local branch
 TODO: when ask to pick two hashes (gsth, gdih, gsvh), ask the user to pick his "older" hash, and "newer" hash
@@ -55,7 +58,11 @@ def GITSummary(srv = '', param = ''):
                adding `monthly', or `weekly', or `daily' at the end will show you the monthly,
                weekly or daily distribution of the user activities
                the default interval is monthly
+            * `gsmr' will rebuild the statistics of the repository kept in .git/gittool/stats,
+               normally only the commits made since the last `gsm' are read.
     """
+    if 'r' in srv: # throw away the kept statistics and read the whole history again
+        get_repo_stats(rebuild = True)
     if len(param) > 1: # there are additional parameters to the command
         _author = [x for x in param[1:] if '@' in x]
         if os.path.isfile(param[1]): # we will do a summary on the file
@@ -98,9 +105,8 @@ def GITSummary(srv = '', param = ''):
                              for x in contributors])
         print(paint('yellow', 'Top5 Active Contributors (in 100 recent commits)>>>\n\t') + _list)
         #shows top 3 touched file/dir, use gsmf to show all touched file/dir of the repo
-        _commit_range = total_commits if total_commits < 100 else 100
         print(paint('yellow', 'Top5 Active Areas (in 100 recent commits)>>>\n\t') +
-              '\n\t'.join(get_file_change_distribution(_commit_range, first_x=5)))
+              '\n\t'.join(get_recent_change_distribution(100, first_x=5)))
     return ''
     #shows the total commit number of the repo
 
@@ -185,8 +191,13 @@ def GITLoad(srv, param):
               When issued in a git path, with no parameter given
               `gld' will perform a git fetch (update the local repo),
               and allow to merge, rebase, or quit after fetch.
-              Use `gldp' to create a process that will fetch the changes from the remote
-              repository in background for you, at specified time every day.
+              Use `gldp' to have a background process fetch the changes from the remote
+              repository for you, at specified time every day (core.UpdateTime, e.g.
+              "8:0:0, 13:30:0"). The process also writes the commit-graph and runs
+              `git gc --auto' after each fetch. One process serves all the repositories
+              registered with `gldp'. `gldp list' lists them, `gldp status' shows when
+              they were last updated, `gldp remove' stops updating the current one and
+              `gldp stop' stops the process.
 
             * a git apply - load changes from a patch file
               When `gld <patch_name>' in a git path
@@ -221,6 +232,8 @@ def GITLoad(srv, param):
             exit_with_error("You need to run the command in a git repo")
         return do_clone()
     else: #in a git path
+        if _ifperiodically_load: #to start or control the background updating process
+            return do_periodical_fetch(param[1] if len(param) > 1 else '')
         _curbranch = get_current_branch()
         if len(param) == 2: #something is provided as the parameter
             _in_branch_list = param[1] in get_branch_list()[1]
@@ -282,12 +295,6 @@ def GITLoad(srv, param):
                                          ball = _ball)
                 do_checkout_file_from_commit(_load_files, _load_hash)
                 return 'done'
-            elif _ifperiodically_load: # to start a background updating process
-                pid = os.fork()
-                if pid > 0: #the parent process
-                    print("The local repository will be udpated periodically.")
-                else:       #the newly created background process
-                    do_periodical_fetch()
             else: # if i have to guess, i will try updating the repo
                 _ans = get_answer(prompt = "Update current repository? [Y/n]",
                                   default = 'y',
@@ -351,9 +358,9 @@ def GITDiff(srv, param):
         if _ishash and not _hashes: #allow user to select hashes on the fly
             _hashes = select_hash_range(file = _file)
     if _iscombined:
-        _cmd = git.show(selection = _hashes, param = '-m --pretty=short', file = _file)
+        _cmd = git.show_argv(selection = _hashes, param = ['-m', '--pretty=short'], file = _file)
     else:
-        _cmd = git.difftool(_difftool, _hashes, _remote_branch, _file)
+        _cmd = git.difftool_argv(_difftool, _hashes, _remote_branch, _file)
     #if there are too many files, warn the user before doing diff
     _num = number_of_changed_files(_hashes, _remote_branch, _file)
     if _num > 7: # i guess 7 is a good limit
@@ -364,7 +371,7 @@ def GITDiff(srv, param):
             exit()
     #for vim it appears we need to invoke it via os.system to make it work correctly
     if _difftool == 'vimdiff':
-        os.system(_cmd)
+        subprocess.call(_cmd)
     else:
         _tmp = invoke(_cmd)
     return ''
@@ -382,6 +389,9 @@ def GITStatus(srv, param):
          `gst <hash>' or `gst <branch>' shows the changed files
        * working copy and its tracked/linked remote
          `gstr' shows the changed files
+       * working copy and the latest commit, as it changes
+         `gstw' shows the changed files and keeps the list up to date
+         as files are changed, until you quit with `/e'
        * `gstg <number of versions to look back>' shows a distribution graph of changes
          on files/directories
 
@@ -435,6 +445,7 @@ def GITStatus(srv, param):
     """
     check_git_path()
     _isremote, _ishash, _isgraph = ('r' in srv), ('h' in srv), ('g' in srv)
+    _iswatch = 'w' in srv
     _dir, _compare_str = '', ''
     if _isgraph: #show a change distribution graph on files/directories in the current path
         output = get_file_change_distribution(param[1] if len(param) > 1 else 1)
@@ -446,6 +457,19 @@ def GITStatus(srv, param):
         else:
             _compare_str = x
     _ans = ''
+    if _iswatch: #one list of the working copy, updated by the watcher as files change
+        _status, x = do_status(dir = _dir)
+        _changed, _untracked = get_changed_files(_status)
+        _files = FileBall(_changed + _untracked)
+        _files.term.keep_height = True #the list may grow while it is shown
+        TERM_SESSION.watchers.append(StatusWatcher(_files, _dir))
+        while _ans != '/e':
+            _ans = get_answer(title = [make_status_header(get_current_branch(), 'working copy')],
+                              prompt = '',
+                              default = '/e',
+                              help = _git_status_code,
+                              ball = _files)
+        return ''
     while True and _ans != '/e': #keep do_status in the loop so that we update the status every time.
         _status, _compare_str = do_status(isremote = _isremote, ishash = _ishash, dir = _dir,
                                           compare_str = _compare_str)
@@ -456,18 +480,11 @@ def GITStatus(srv, param):
             else:
                 if if_branch_exist(_compare_str): #only one candidate given, which is a branch
                     _comp2, _comp1 = _compare_str, get_current_branch()
-                elif 'unknown revision' in _status: #something wrong with the given candidate
-                    exit_with_error('unknown hash/branch, please check')
                 else:#assume this is comparison between hashes
                     _comp1, _comp2 = _compare_str, get_hashes(1)[0]
                 if num_uncommited_files(): #show 'working copy' if there is any local change
                     _comp2 = 'working copy'
-            if not _status or not _status.strip(' '):
-                _status = '' #there is no changes found
-                _changes = 0
-            else:
-                _changes = len(split(_status, '\n')) - 1
-            _changed = split(_status, '\n')[:-1]
+            _changed = _status
             _untracked= []
         else: #show changed but not yet commited files, with indexes added
             _changed, _untracked= get_changed_files(_status)
@@ -499,11 +516,11 @@ def GITList(srv, param):
         * by asking for the tag info
           `glst <other options>'
           shows more information including branches and tags, if there is any.
-          However, fetching the tag info would take a bit more time.
         * show commit information in a graph.
           `glsg <range options>' shows a graphical commit tree.
-          Options can be given to specify a range
-          *NOTE*: graphviz is required to enable the "g" option
+          Options can be given to specify a range.
+          While the graph is open, running glsg again updates it in place
+          *NOTE*: pygtk is required to enable the "g" option
         * show commit information between two dates
           `glsd <other options>'
     """
@@ -529,15 +546,13 @@ def GITList(srv, param):
     else:
         _format='___%nRev:       %h%nAuthor:    %an [%ae]%nDate:      %cd%nComment:   %s'
         if _num != 0:
-            _range = '-%d' % _num
+            _range = ['-%d' % _num]
         else:
-            _range = "-%(num_of_log)d --skip=%(num_to_skip)d" %\
-                    {'num_of_log': abs(_since - _until) + 1,
-                     'num_to_skip': min(_since, _until) - 1}
+            _range = ['-%d' % (abs(_since - _until) + 1),
+                      '--skip=%d' % (min(_since, _until) - 1)]
         if _file: #look for commit logs for given files
-            _range += ' -- %s ' % ' '.join(_file)
+            _range += ['--'] + _file
         if _if_show_tag: #show the tag info
-            print("this will take a while...")
             _result = do_log_tag(_range)
         elif _author or _if_date: #only show logs of given author, or date
             _result = do_log_author_or_date(_if_date, _format, _range, _author)
@@ -572,20 +587,46 @@ def GITConfig(srv, param):
             print("Configuration has been changed to the following:\n")
     return get_configurations()
 
+def GITServer(param):
+    """ gsrv
+        To keep a GitTool server running in the background. Every GitTool command
+        started from a terminal is then run by the server, which has GitTool loaded
+        already, instead of by a new python process.
+            `gsrv start' - start the server (it quits after an hour without commands)
+            `gsrv stop' - stop the server
+            `gsrv' or `gsrv status' - tell whether the server is running
+        Commands not run from a terminal, e.g. with their output piped, always run
+        on their own.
+    """
+    _action = param[1] if len(param) > 1 else 'status'
+    if _action == 'start':
+        if gitserver.start(main):
+            return "GitTool server started."
+        return "GitTool server is already running."
+    elif _action == 'stop':
+        return "GitTool server stopped." if gitserver.control('stop')\
+               else "GitTool server is not running."
+    elif _action == 'status':
+        _status = gitserver.control('status')
+        return ("GitTool server: " + _status) if _status else "GitTool server is not running."
+    exit_with_error("Don't know how to '%s', try start, stop or status" % _action)
+
 #setup the environment for first use
 def GITSetup(param):
     if len(param) == 2 and param[1] == 'clean':
         print("removing all the link files...")
         traverse_nested_list_with_action(SERVICES, remove_link_file)
         print("restore the .gitconfig file")
-        invoke('cp ~/.gitconfig ~/.gitconfig.gittool')
-        invoke('mv ~/.gitconfig.gittool.backup ~/.gitconfig')
+        _gitconfig = os.path.expanduser('~/.gitconfig')
+        invoke(['cp', _gitconfig, _gitconfig + '.gittool'])
+        invoke(['mv', _gitconfig + '.gittool.backup', _gitconfig])
         exit()
     _ans = get_answer(prompt = 'Would you like to setup GITTool? [y/N]', default = 'n',
                        help = 'This will simply create a bunch of symbol links for you.' +
                               '\nSo would you like to setup GITTool? [y/N]')
     if 'y' == _ans or 'Y' == _ans:
-        invoke('cp ~/.gitconfig ~/.gitconfig.gittool.backup')
+        _gitconfig = os.path.expanduser('~/.gitconfig')
+        invoke(['cp', _gitconfig, _gitconfig + '.gittool.backup'])
         print("back up the original .gitconfig file")
         print("if your system supports colored text, you shall see them below:")
         for c in color.keys():
@@ -628,20 +669,17 @@ def GITSetup(param):
             if type(service) == list:
                 #this is a nested list, right now we support 2-level nested list
                 for sub_service in service:
-                    invoke("ln -s %(source)s %(link)s" %
-                            {'source' : _source, 'link' : _target_dir + '/' + sub_service})
+                    invoke(['ln', '-s', _source, _target_dir + '/' + sub_service])
             else:
-                invoke("ln -s %(source)s %(link)s" %
-                        {'source' : _source,
-                         'link' : _target_dir+'/'+service})
+                invoke(['ln', '-s', _source, _target_dir + '/' + service])
         #copy the supporing files
         invoke("cp -R support/* %s" % _target_dir)
         print("done.\ntry ghelp for more info")
 
 #a list of services provided to the user, via symbolic links
 SERVICES = [ 'gsv', 'gsvh', 'gsvf',
-             'gld', 'gldr', 'gldb', 'gldh', 'gldt', 'gldf', 'gldm',
-             'gst',
+             'gld', 'gldr', 'gldb', 'gldh', 'gldt', 'gldf', 'gldm', 'gldp',
+             'gst', 'gstw',
              ['gst' + x for x in allperm('hdr')], #combination of 'h', 'd', 'r'
              'gcf', 'gcfb', 'gcfc',
              'gls', 'glst', 'glsg',
@@ -649,7 +687,8 @@ SERVICES = [ 'gsv', 'gsvh', 'gsvf',
              'gdi',
              [ 'gdi' + x for x in allperm('2rh')], # combination of 'r','h','2'
              [ 'gdi' + x for x in allperm('3rh')], # combination of 'r','h','3'
-             'gsm',
+             'gsm', 'gsmr',
+             'gsrv',
              'ghelp' ]
 
 CALL_TABLE = { 'gst': GITStatus,
@@ -660,16 +699,18 @@ CALL_TABLE = { 'gst': GITStatus,
                'gsm': GITSummary,
                'gcf': GITConfig}
 
-if __name__ == '__main__':
+def main():
     """
     the main function
     this tool works like busybox: all the symbolic links to the same file.
     depending on what command name is invoked, we provide corresponding services.
     """
-    invoke('export LANG=en_US.UTF-8')
+    os.environ['LANG'] = 'en_US.UTF-8' #inherited by every git process we start
     #get the service requested by the user
-    parser = OptionParser()
-    service = parser.get_prog_name()
+    service = os.path.basename(sys.argv[0])
+    if service == 'gsrv':
+        print(GITServer(sys.argv))
+        return
     if DEBUG:
         #a major service will always be a 3-character key word
         if service == 'ghelp':
@@ -719,3 +760,6 @@ if __name__ == '__main__':
                     GITSetup(sys.argv)
         except Exception, err:
             sys.stderr.write('ERROR: %s\n' % str(err))
+
+if __name__ == '__main__':
+    main()
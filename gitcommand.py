@@ -1,4 +1,3 @@
-import pdb
 
 def blame(file, param = ''):
     return 'git blame %s %s' % (file, param)
@@ -48,6 +47,9 @@ def checkout(target = '', new_branch = '', track = ''):
 def merge(param = ''):
     return 'git merge %s' % param
 
+def mergebase(param = ''):
+    return 'git merge-base %s' % param
+
 def mergetool(param = ''):
     return 'git mergetool %s' % param
 
@@ -77,6 +79,9 @@ def status(param = ''):
 def showref(branch = ''):
     return 'git show-ref -s %s' % branch
 
+def foreachref(format = '', pattern = ''):
+    return "git for-each-ref %s %s" % (("--format='%s'" % format) if format else '', pattern)
+
 def show(selection = '', param = '', file = ''):
     return 'git show %s %s %s' % (selection, param, file)
 
@@ -100,6 +105,9 @@ def config(type = '', section = '', element = '', value = None, exp = None):
 def revparse(hash = '', param = ''):
     return 'git rev-parse %s %s' % (hash, param)
 
+def revlist(revs = '', param = ''):
+    return 'git rev-list %s %s' % (param, revs)
+
 def reset(file):
     return 'git reset %s' % file
 
@@ -120,3 +128,144 @@ def add(file):
         return 'git add %s' % ' '.join(file)
     else:
         return 'git add %s' % file
+
+def tag(contains = ''):
+    return 'git tag %s' % (('--contains %s' % contains) if contains else '')
+
+#-------------------argv forms
+#The builders below return the command as an argument list. invoke() executes
+#such a list directly, without a /bin/sh in between, and no quoting is needed
+#for file names, messages or formats containing spaces.
+
+def blame_argv(file, param = []):
+    return ['git', 'blame'] + param + ['--', file]
+
+def diff_argv(selection = '', name_only = True, type = 'ACDMRTUXB*', param = [], paths = []):
+    return ['git', 'diff'] + ([selection] if selection else []) + param +\
+           (['--name-only'] if name_only else []) +\
+           (['--diff-filter=%s' % type] if type else []) +\
+           (['--'] + paths if paths else [])
+
+def difftool_argv(difftool, hashes, remote_branch, file):
+    return ['git', 'difftool', '-y'] + (['-t', difftool] if difftool else []) +\
+           [x for x in (hashes, remote_branch) if x] +\
+           (['--'] + file if file else [])
+
+def shortlog_argv(param = []):
+    return ['git', 'shortlog'] + param
+
+def log_argv(revs = [], num = 0, format = '', param = [], authors = [], paths = []):
+    return ['git', 'log'] + (['-%d' % num] if num > 0 else []) +\
+           (['--format=%s' % format] if format else []) + param + revs +\
+           ['--author=%s' % x for x in authors] +\
+           (['--'] + paths if paths else [])
+
+def init_argv(param = []):
+    return ['git', 'init'] + param
+
+def patch_argv(selection):
+    return ['git', 'format-patch', '-k', '--full-index', '--stdout', selection]
+
+def clone_argv(url):
+    return ['git', 'clone', url]
+
+def fetch_argv(url = '', src = '', dst = ''):
+    return ['git', 'fetch'] + ([url] if url else []) +\
+           (['%s:%s' % (src, dst)] if src and dst else [])
+
+def checkout_argv(target = '', new_branch = '', track = '', files = []):
+    return ['git', 'checkout'] + (['-b', new_branch] if new_branch else []) +\
+           (['-t', track] if track else []) + ([target] if target else []) +\
+           (['--'] + files if files else [])
+
+def merge_argv(ref = '', param = []):
+    return ['git', 'merge'] + param + ([ref] if ref else [])
+
+def mergebase_argv(param = []):
+    return ['git', 'merge-base'] + param
+
+def mergetool_argv(param = []):
+    return ['git', 'mergetool'] + param
+
+def branch_argv(lsoption = None, del_branch = '', force_del_branch = '',
+                branch = '', contains = '', upstream = ''):
+    if lsoption is not None:
+        return ['git', 'branch', '-l'] + ([lsoption] if lsoption else [])
+    if del_branch:
+        return ['git', 'branch', '-d', del_branch]
+    if force_del_branch:
+        return ['git', 'branch', '-D', force_del_branch]
+    if contains:
+        return ['git', 'branch', '--contains', contains]
+    if upstream and branch:
+        return ['git', 'branch', '--set-upstream', branch, upstream]
+    return ['git', 'branch'] + ([branch] if branch else [])
+
+def push_argv(repo, branch, ref, param = []):
+    return ['git', 'push', repo, '%s:%s' % (branch, ref)] + param
+
+def rebase_argv(param = []):
+    return ['git', 'rebase'] + param
+
+def status_argv(param = []):
+    return ['git', 'status'] + param
+
+def lsfiles_argv(param = [], paths = []):
+    return ['git', 'ls-files'] + param + (['--'] + paths if paths else [])
+
+def checkignore_argv(param = [], paths = []):
+    return ['git', 'check-ignore'] + param + (['--'] + paths if paths else [])
+
+def showref_argv(branch = ''):
+    return ['git', 'show-ref', '-s'] + ([branch] if branch else [])
+
+def foreachref_argv(format = '', pattern = []):
+    return ['git', 'for-each-ref'] + (['--format=%s' % format] if format else []) + pattern
+
+def show_argv(selection = '', param = [], file = []):
+    return ['git', 'show'] + ([selection] if selection else []) + param +\
+           (['--'] + file if file else [])
+
+def config_argv(type = '', section = '', element = '', value = None, exp = None):
+    _scope = '--local' if type == 'local' else '--global'
+    if exp: #for querying config items via a regular expression
+        return ['git', 'config', '--get-regexp', exp]
+    if value: #set function to an element, replacing all of its values
+        return ['git', 'config', _scope, '--replace-all', element, value]
+    elif value == '': #remove a section, or an element with all of its values
+        if element:
+            return ['git', 'config', _scope, '--unset-all', element]
+        if section:
+            return ['git', 'config', _scope, '--remove-section', section]
+    else: #get function, when value is None
+        return ['git', 'config', _scope, element]
+
+def revparse_argv(hash = '', param = []):
+    return ['git', 'rev-parse'] + ([hash] if hash else []) + param
+
+def symbolicref_argv(ref = 'HEAD', param = []):
+    return ['git', 'symbolic-ref'] + param + [ref]
+
+def revlist_argv(revs = [], param = []):
+    return ['git', 'rev-list'] + param + revs
+
+def reset_argv(file):
+    return ['git', 'reset', '--', file]
+
+def remote_argv(param = []):
+    return ['git', 'remote'] + param
+
+def commit_argv(msg, files = [], param = []):
+    return ['git', 'commit'] + param + ['-m', msg] + (['--'] + files if files else [])
+
+def lsremote_argv(url, branch):
+    return ['git', 'ls-remote', url, branch]
+
+def apply_argv(patch_file, check = False, param = []):
+    return ['git', 'apply'] + (['--check'] if check else []) + param + [patch_file]
+
+def add_argv(file):
+    return ['git', 'add', '--'] + (file if type(file) is list else [file])
+
+def tag_argv(contains = ''):
+    return ['git', 'tag'] + (['--contains', contains] if contains else [])
@@ -1,19 +1,35 @@
 import gitcommand as git
-import subprocess, pdb, os, sys, re, math, time, operator, termios, datetime
-try:
-    from apscheduler.scheduler import Scheduler
-except:
-    pass
+import subprocess, os, sys, re, time, atexit, collections, fcntl, struct, heapq, signal
 
 class TextWindowManager(object):
-    def __init__(self, up, down):
+    """
+    Keeps the windows stacked in the terminal and what was last drawn in
+    each of them, so that an update only rewrites the lines that changed.
+    """
+    def __init__(self, up, down, clear_eol = ''):
         self.windows = [] # keeps all the windows
+        self.frames = {} # the lines last drawn in each window
         self.current_ptr = 0 # keeps track of the current line of the text cursor
         self.UP = up
         self.DOWN = down
+        self.CLEAR_EOL = clear_eol
     def create_window(self, width, height):
         self.windows.append([width, height])
         return len(self.windows) # this would be the id for the new window
+    def fit_line(self, win_id, line):
+        width = self.windows[win_id][0]
+        line = line.expandtabs()
+        # there are corner cases where the 'color['end']' is cut out,
+        # we need to get rid of that
+        if line.endswith(color['end']) and len(line) > width:
+            return line[:width] + color['end']
+        return line[:width]
+    def move_to(self, row):
+        # returns what moves the cursor from the current line to the given one
+        _moves = self.UP * (self.current_ptr - row) if row < self.current_ptr\
+                 else self.DOWN * (row - self.current_ptr)
+        self.current_ptr = row
+        return _moves
     def term_print(self, win_id, str):
         width = self.windows[win_id][0]
         for line in str.split('\n'):
@@ -36,9 +52,28 @@ class TextWindowManager(object):
         window = self.windows[win_id]
         self.term_print(1, (' ' * window[0] + '\n') * window[1])
     def update_window(self, win_id, str):
-        self.clear_window(win_id)
-        self.move_to_top(win_id)
-        self.term_print(win_id, str)
+        _top = sum([h for w, h in self.windows[:win_id]])
+        _lines = [self.fit_line(win_id, x) for x in str.split('\n')]
+        _old = self.frames.get(win_id)
+        if _old is None: # nothing known about the window, draw all of it
+            _old = [None] * self.windows[win_id][1]
+        _out = []
+        for row in range(max(len(_lines), len(_old))):
+            _line = _lines[row] if row < len(_lines) else ''
+            if row < len(_old) and _old[row] == _line:
+                continue # the line on the screen is still good
+            _out.append(self.move_to(_top + row))
+            if self.CLEAR_EOL:
+                _out.append('\r' + self.CLEAR_EOL + _line + '\n')
+            else: # overwrite what was there with spaces, the color codes take no room
+                _width = len(re.sub('\033[^m]*m', '', _line))
+                _out.append('\r' + _line + ' ' * (self.windows[win_id][0] - _width) + '\n')
+            self.current_ptr += 1
+        # leave the cursor right below the text, as printing it would
+        _out.append(self.move_to(_top + len(_lines)))
+        self.frames[win_id] = _lines
+        sys.stdout.write(''.join(_out)) # everything goes out in one write
+        sys.stdout.flush()
     def set_win_height(self, win_id, height):
         self.windows[win_id][1] = height
     def set_win_width(self, win_id, width):
@@ -49,6 +84,7 @@ class TextWindowManager(object):
         return self.windows[win_id][0]
     def reset_ptr(self):
         self.current_ptr = 0
+        self.frames = {} # drawing starts over on fresh lines
 
 
 # borrowed from
@@ -116,6 +152,13 @@ class TerminalController:
     COLS = None          #: Width of the terminal (None for unknown)
     LINES = None         #: Height of the terminal (None for unknown)
 
+    # Called when paging past the end of the buffer, returns the number of lines added
+    more = None
+
+    # Keep the buffer window at its full height when the buffer is shorter,
+    # for a buffer that may grow while it is shown
+    keep_height = False
+
     # Foreground colors:
     BLACK = BLUE = GREEN = CYAN = RED = MAGENTA = YELLOW = WHITE = ''
 
@@ -177,16 +220,37 @@ class TerminalController:
         if set_bg_ansi:
             for i,color in zip(range(len(self._ANSICOLORS)), self._ANSICOLORS):
                 setattr(self, 'BG_'+color, curses.tparm(set_bg_ansi, i) or '')
-        self.text_buffer = ''
+        self.get_lines = lambda begin, end: []
         self.title = ''
         self.buffer_size = 0
         self.buffer_begin = 0
         self.buffer_end = 0
-        self.win_mgr = TextWindowManager(self.UP, self.DOWN)
+        self.win_mgr = TextWindowManager(self.UP, self.DOWN, self.CLEAR_EOL)
         self.item_height = item_height
-    def set_buffer(self, buff):
-        self.text_buffer = '\n'.join(buff).split('\n')
-        self.buffer_size = '\n'.join(buff).count('\n') + 1# line # of the buffer
+    def set_buffer(self, size, get_lines):
+        #the buffer is virtual: get_lines(begin, end) makes the lines in the range
+        #when they are shown, so only what fits in the window is ever formatted
+        self.buffer_size = size # line # of the buffer
+        self.get_lines = get_lines
+    def refresh_buffer(self, size):
+        #the buffer has changed, show its first page without resizing the window
+        self.buffer_size = size
+        self.buffer_begin = 0
+        self.buffer_end = min(self.win_mgr.get_win_height(1), size)
+        self.win_mgr.update_window(1, self.get_window_lines())
+    def get_window_lines(self, highlight = []):
+        _lines = self.get_lines(self.buffer_begin, self.buffer_end)
+        for idx in highlight or []:
+            first_line = idx * self.item_height
+            for line in xrange(max(first_line, self.buffer_begin),
+                               min(first_line + self.item_height, self.buffer_end)):
+                try:
+                    _lines[line - self.buffer_begin] = color['reverse'] +\
+                                                       _lines[line - self.buffer_begin] +\
+                                                       color['end']
+                except LookupError:
+                    pass # some of the selection is invalid, just ignore
+        return '\n'.join(_lines)
     def reset_window(self):
         self.win_mgr.reset_ptr()
     def set_windows(self, width1, height1, width2, height2, width3, height3):
@@ -217,33 +281,29 @@ class TerminalController:
                             if self.buffer_begin > win_height\
                             else 0
         self.buffer_end = self.buffer_begin + win_height
+    def page_to_line(self, line):
+        # move to the page holding the line, the pages start at multiples of the window height
+        win_height = self.win_mgr.get_win_height(1)
+        if self.buffer_begin <= line < self.buffer_end or not win_height:
+            return
+        self.buffer_begin = line / win_height * win_height
+        self.buffer_end = min(self.buffer_begin + win_height, self.buffer_size)
     def show_buffer(self, browse_mode = True, highlight = [], jump_to = None):
         self.win_mgr.update_window(0, self.title)
-        _buffer = self.text_buffer[:] # to copy the list
         if highlight or jump_to:
             # we are asked to show the highlighted portion of the buffer
-            for idx in highlight:
-                try:
-                    first_line = idx * self.item_height
-                    for l in xrange(self.item_height):
-                        line = first_line + l
-                        _buffer[line] = color['reverse'] + self.text_buffer[line] + color['end']
-                except LookupError:
-                   pass # some of the selection is invalid, just ignore
             _last_hl_idx = jump_to if jump_to else highlight[-1]
             if _last_hl_idx < 0 or _last_hl_idx > self.buffer_size / self.item_height:
                 return # this is not a valid input
             # if the highlighted item is outside of this window, we
             # will update the window to show the item
-            while _last_hl_idx < self.buffer_begin / self.item_height:
-                self.backward_buffer()
-            while _last_hl_idx >= self.buffer_end / self.item_height:
-                self.forward_buffer()
+            self.page_to_line(_last_hl_idx * self.item_height)
         if self.win_mgr.get_win_height(1) >= self.buffer_size:
             # we can show the entire text buffer
-            self.win_mgr.set_win_height(1, self.buffer_size)
+            if not self.keep_height:
+                self.win_mgr.set_win_height(1, self.buffer_size)
             self.buffer_end = self.buffer_size
-            self.win_mgr.update_window(1, '\n'.join(_buffer[self.buffer_begin:self.buffer_end]))
+            self.win_mgr.update_window(1, self.get_window_lines(highlight))
         else:
             # we will show part of the text buffer
             digit_keys = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '0']
@@ -251,17 +311,22 @@ class TerminalController:
             quit_keys = ['TwiceEsc', 'q', 'Q'] + pass_back_keys
             page_down_keys = ['PgDn', 'j', 'J', ' ', 'Down', 'Enter']
             page_up_keys = ['PgUp', 'Up', 'k', 'K']
-            self.win_mgr.update_window(1, '\n'.join(_buffer[self.buffer_begin:self.buffer_end]))
+            self.win_mgr.update_window(1, self.get_window_lines(highlight))
             if browse_mode == False:
                 return # escape when we are told only to show the buffer and quit
             _key = capture_keypress()
-            while (_key not in quit_keys and
-                   not (_key == ' ' and self.buffer_end >= self.buffer_size)) :
-                if _key in page_down_keys:
+            while _key not in quit_keys:
+                if _key in page_down_keys and self.buffer_end >= self.buffer_size:
+                    #paging past the end, ask the ball for more items if it has
+                    _added = self.more() if self.more else 0
+                    if not _added and _key == ' ':
+                        break
+                    self.buffer_size += _added
+                if _key in page_down_keys and self.buffer_end < self.buffer_size:
                     self.forward_buffer()
                 elif _key in page_up_keys:
                     self.backward_buffer()
-                self.win_mgr.update_window(1, '\n'.join(_buffer[self.buffer_begin:self.buffer_end]))
+                self.win_mgr.update_window(1, self.get_window_lines(highlight))
                 _key = capture_keypress()
             if _key in pass_back_keys:
                 return _key
@@ -287,6 +352,296 @@ class TerminalController:
         if s == '$$': return s
         else: return getattr(self, s[2:-1])
 
+class TerminalSession(object):
+    """
+    The keyboard side of the terminal. Used as a context manager, it puts
+    the terminal in non-canonical, no-echo mode on the way in and restores
+    it on the way out; nested uses keep the mode set by the outermost one,
+    so a whole prompt costs a single pair of tcsetattr calls. The bytes
+    are read in chunks and kept in a buffer to decode escape sequences.
+    While it waits for a key it also serves the watchers (see StatusWatcher):
+    objects with a fileno() (or None), called on_event() when it is readable,
+    and a 'due' time (or None) at which on_due() is called.
+    """
+    def __init__(self, stream = sys.stdin):
+        self.stream = stream
+        self.depth = 0
+        self.saved = None
+        self.pending = ''
+        self.watchers = []
+    def __enter__(self):
+        import termios
+        if self.depth == 0 and self.stream.isatty():
+            _fd = self.stream.fileno()
+            self.saved = termios.tcgetattr(_fd)
+            _new = termios.tcgetattr(_fd)
+            _new[3] = _new[3] & ~termios.ICANON & ~termios.ECHO
+            _new[6][termios.VMIN] = 1
+            _new[6][termios.VTIME] = 0
+            termios.tcsetattr(_fd, termios.TCSANOW, _new)
+        self.depth += 1
+        return self
+    def __exit__(self, *exc):
+        import termios
+        self.depth -= 1
+        if self.depth == 0 and self.saved is not None:
+            termios.tcsetattr(self.stream.fileno(), termios.TCSANOW, self.saved)
+            self.saved = None
+        return False
+    def read_byte(self):
+        while not self.pending:
+            if self.watchers:
+                self.wait_for_key()
+            _chunk = os.read(self.stream.fileno(), 64)
+            if not _chunk: #end of input
+                raise EOFError
+            self.pending += _chunk
+        _byte, self.pending = self.pending[0], self.pending[1:]
+        return _byte
+    def wait_for_key(self):
+        import select
+        while True:
+            _due = [x.due for x in self.watchers if x.due is not None]
+            _timeout = max(0, min(_due) - time.time()) if _due else None
+            try:
+                _ready = select.select([self.stream] + [x for x in self.watchers
+                                                        if x.fileno() is not None],
+                                       [], [], _timeout)[0]
+            except select.error: #interrupted by a signal, e.g. the terminal is resized
+                continue
+            for x in self.watchers:
+                if x in _ready:
+                    x.on_event()
+                if x.due is not None and x.due <= time.time():
+                    x.on_due()
+            if self.stream in _ready:
+                return
+    def size(self):
+        import termios
+        #(rows, columns) of the terminal, asked to the tty driver
+        for _fd in [sys.stdout.fileno(), self.stream.fileno()]:
+            try:
+                _rows, _cols = struct.unpack('hh', fcntl.ioctl(_fd, termios.TIOCGWINSZ,
+                                                               '\0' * 4))
+                if _rows and _cols:
+                    return _rows, _cols
+            except (IOError, OSError):
+                pass
+        return (int(os.environ.get('LINES', 24)), int(os.environ.get('COLUMNS', 80)))
+
+class SearchIndex(object):
+    """
+    A trigram index over a list of items, to find the items holding all the
+    words of a query (case-insensitive). The index is built by a background
+    thread; the items it has not reached yet, or appended after it stopped,
+    are simply scanned. A query extending the previous one (as when it is
+    typed character by character) only looks at the previous matches.
+    """
+    def __init__(self, items):
+        self.items = items
+        self.grams = {} # trigram => positions of the items holding it, ascending
+        self.indexed = 0 # items[:indexed] are in the index
+        self.thread = None
+        self.last = (None, [], 0) # the last query, its matches and the item number then
+    @staticmethod
+    def match(words, item):
+        _item = item.lower()
+        for w in words:
+            if w not in _item:
+                return False
+        return True
+    def start(self):
+        import threading
+        if self.indexed < len(self.items) and (self.thread is None or not self.thread.is_alive()):
+            self.thread = threading.Thread(target = self.build)
+            self.thread.daemon = True #never keep the command from exiting
+            self.thread.start()
+    def build(self):
+        while self.indexed < len(self.items):
+            _item = self.items[self.indexed].lower()
+            for g in set([_item[i:i + 3] for i in xrange(len(_item) - 2)]):
+                self.grams.setdefault(g, []).append(self.indexed)
+            self.indexed += 1 #only now the positions above can be trusted
+    def search(self, query):
+        _query = query.lower()
+        _words = _query.split()
+        _last_query, _last_result, _last_len = self.last
+        if not _words:
+            _candidates = xrange(len(self.items))
+        elif _last_query is not None and _query.startswith(_last_query):
+            #the new matches are among the old ones and the items added since
+            _candidates = _last_result + range(_last_len, len(self.items))
+        else:
+            self.start()
+            _limit = self.indexed
+            _grams = [w[i:i + 3] for w in _words for i in xrange(len(w) - 2)]
+            if _grams: #only the items holding the rarest trigram need a look
+                _rarest = min([self.grams.get(g, []) for g in _grams], key = len)
+                _candidates = [x for x in _rarest if x < _limit] + range(_limit, len(self.items))
+            else: #too short for the index
+                _candidates = xrange(len(self.items))
+        _result = [x for x in _candidates if self.match(_words, self.items[x])]
+        self.last = (_query, _result, len(self.items))
+        return _result
+
+class StatusWatcher(object):
+    """
+    Keeps the 'git status -s' items of a FileBall up to date while the ball
+    is shown. inotify watches the directories holding tracked files, the
+    untracked ones and the .git directory. The paths touched by a burst of
+    changes are gathered for WATCH_DELAY seconds, then only their status is
+    asked again. A new index or HEAD, lost events or more than
+    WATCH_MAX_PATHS paths make it ask the status of everything. Without
+    inotify, or with more directories than it may watch, the status of
+    everything is asked every WATCH_POLL seconds instead.
+    """
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 02000000
+    TREE_EVENTS = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |\
+                  IN_DELETE | IN_ONLYDIR
+    GIT_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+    def __init__(self, ball, dir = ''):
+        self.ball = ball
+        self.base = os.path.abspath(dir) if dir else root_path() # what is watched
+        self.gitdir = git_dir()
+        self.dirs = {} # watch descriptor => directory
+        self.touched = set() # paths changed since the last update
+        self.tracked = set() # the directories holding tracked files
+        self.everything = False # or everything may have changed
+        self.due = None
+        self.fd = None
+        self.libc = None
+        #our own status must not write the index, or it would wake us up again
+        os.environ['GIT_OPTIONAL_LOCKS'] = '0'
+        try:
+            import ctypes, ctypes.util
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+            self.fd = self.libc.inotify_init1(os.O_NONBLOCK | self.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            self.fd = -1
+        if self.fd < 0 or not self.add_watches():
+            self.poll()
+    def fileno(self):
+        return self.fd
+    def add_watch(self, dir, mask):
+        _wd = self.libc.inotify_add_watch(self.fd, dir, mask)
+        if _wd >= 0:
+            self.dirs[_wd] = dir
+            return True
+        import ctypes, errno
+        return ctypes.get_errno() in [errno.ENOENT, errno.ENOTDIR] #gone already, never mind
+    #watch the directories holding tracked files, and the untracked trees
+    def add_watches(self):
+        if not self.add_watch(self.gitdir, self.GIT_EVENTS):
+            return False
+        _top = root_path()
+        _dirs = set([self.base])
+        _tracked = invoke_stream(git.lsfiles_argv(param = ['-z', '--full-name'],
+                                                  paths = [self.base]))
+        for _file in _tracked.communicate()[0].split('\0'):
+            _dir = os.path.dirname(_file)
+            while _dir not in _dirs: #the directories in between too
+                _dirs.add(_dir)
+                _dir = os.path.dirname(_dir)
+        self.tracked = set([os.path.normpath(os.path.join(_top, x)) for x in _dirs])
+        for _dir in self.tracked:
+            if not self.add_watch(_dir, self.TREE_EVENTS):
+                return False
+        for x in self.ball.all_items:
+            if x.startswith('??') and x.endswith('/'): #an untracked directory
+                if not self.add_tree(os.path.abspath(x[x.find(' ') + 1:])):
+                    return False
+        return True
+    def add_tree(self, dir):
+        for _dir, _subdirs, _files in os.walk(dir):
+            if '.git' in _subdirs: #another repository
+                _subdirs.remove('.git')
+            if not self.add_watch(_dir, self.TREE_EVENTS):
+                return False
+        return True
+    #not enough watches, or no inotify at all
+    def poll(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+        self.fd = None
+        self.dirs = {}
+        self.everything = True
+        self.due = time.time() + WATCH_POLL
+    def on_event(self):
+        try:
+            _buf = os.read(self.fd, 65536)
+        except OSError:
+            return
+        _pos = 0
+        while _pos + 16 <= len(_buf):
+            _wd, _mask, _cookie, _length = struct.unpack_from('iIII', _buf, _pos)
+            _name = _buf[_pos + 16:_pos + 16 + _length].rstrip('\0')
+            _pos += 16 + _length
+            if _mask & self.IN_Q_OVERFLOW: #events are lost
+                self.everything = True
+            elif _mask & self.IN_IGNORED:
+                self.dirs.pop(_wd, None)
+            elif self.dirs.get(_wd) == self.gitdir:
+                if _name in ['index', 'HEAD']:
+                    self.everything = True
+            elif _wd in self.dirs:
+                _path = os.path.join(self.dirs[_wd], _name)
+                self.touched.add(_path)
+                if _mask & self.IN_ISDIR and _mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    if subprocess.call(git.checkignore_argv(param = ['-q'], paths = [_path])):
+                        if not self.add_tree(_path): #not ignored, watch it too
+                            self.poll()
+                            return
+        if self.due is None and (self.touched or self.everything):
+            self.due = time.time() + WATCH_DELAY
+    def on_due(self):
+        if self.fd is None: #polling
+            self.due = time.time() + WATCH_POLL
+        else:
+            self.due = None
+        _paths = self.get_paths()
+        if _paths is None:
+            _pathspec = [self.base]
+        else:
+            _pathspec = [':(literal)' + x for x in _paths]
+        self.touched = set()
+        self.everything = False
+        #not through invoke, its debug output would break the list shown
+        _cmd = git.status_argv(param = ['-s', '--'] + _pathspec)
+        _out = subprocess.Popen(_cmd, stdout = subprocess.PIPE,
+                                stderr = open(os.devnull, 'w')).communicate()[0]
+        _status = split(translate_status_code(' '.join(_cmd), _out), '\n')
+        self.ball.update([x for x in _status if x], _paths)
+    #the paths to ask the status of, None for everything. Only the status of
+    #everything collapses the files of an untracked directory into 'dir/', so a
+    #path in a listed untracked directory stands for the directory, and a path
+    #in another directory without tracked files needs the status of everything
+    def get_paths(self):
+        if self.everything or len(self.touched) > WATCH_MAX_PATHS:
+            return None
+        _cwd = os.getcwd()
+        _untracked = [os.path.normpath(os.path.join(_cwd, x[x.find(' ') + 1:]))
+                      for x in self.ball.all_items if x.startswith('??') and x.endswith('/')]
+        _paths = set()
+        for _path in self.touched:
+            _dirs = [x for x in _untracked if _path.startswith(x + '/')]
+            if _dirs:
+                _paths.add(_dirs[0])
+            elif os.path.dirname(_path) in self.tracked:
+                _paths.add(_path)
+            else:
+                return None
+        return list(_paths)
+
 #-------------------INTERNAL CLASSES-------------------
 class Ball(object):
     """
@@ -294,16 +649,16 @@ class Ball(object):
     the carrier is able to perform certain operations on the data it holds.
     """
     def __init__(self, _blist, name = 'item'):
-        _height, _width = os.popen('stty size', 'r').read().split()
-        self.term_height = int(_height)
-        self.term_width = int(_width)
-        #cut off the over-length data so that we could show the data
-        #better in the terminal
-        self.blist = [x[:self.term_width] for x in _blist]
+        self.term_height, self.term_width = TERM_SESSION.size()
+        self.all_items = _blist # every item the ball holds
+        self.blist = _blist # the items shown, all of them or the ones matching the keyword
+        self.keyword = None
+        self.search_index = None
         self.name = name
         self.highlight = 0
         self.selected_list = []
         self.display_list = []
+        self.hl = None # the item with the index painted
         # for better control of the terminal output
         self.term = TerminalController(item_height = self.get_height())
         self.help = "You can: \
@@ -311,14 +666,54 @@ class Ball(object):
           \n   Type the name for a %(name)s or,\
           \n   Use '/d <item_index>' to delete an %(name)s or,\
           \n   Use '/a <item_index>' to add an %(name)s or,\
+          \n   Use '/f <keyword>' to show only the matching %(name)ss or,\
           \n   Use '/e' to quit" % {'name': self.name}
     def __getitem__(self, k):
         return self.blist[k]
+    def set_items(self, items):
+        self.all_items = self.blist = items
+        self.keyword = None
+        self.search_index = None # the positions have changed
+    #show only the items matching the keyword, or all of them when it is empty
+    #returns the number of items shown
+    def filter(self, keyword):
+        self.keyword = keyword.strip() if keyword and keyword.strip() else None
+        if self.keyword is None:
+            self.blist = self.all_items
+        else:
+            if self.search_index is None:
+                self.search_index = SearchIndex(self.all_items)
+            self.blist = [self.all_items[x] for x in self.search_index.search(self.keyword)]
+        return len(self.blist)
+    #the items have changed while they are shown, draw them again in place
+    def refresh(self):
+        self.search_index = None # the positions have changed
+        self.filter(self.keyword)
+        _term = self.term
+        if not getattr(_term, 'win_mgr', None) or not _term.win_mgr.windows: #not shown
+            return
+        _term.buffer_size = len(self.blist) * self.get_height()
+        if _term.buffer_begin >= _term.buffer_size: #the page shown is gone
+            _term.buffer_begin = 0
+        _term.buffer_end = min(_term.buffer_begin + _term.win_mgr.get_win_height(1),
+                               _term.buffer_size)
+        _term.win_mgr.update_window(1, _term.get_window_lines())
+        _term.win_mgr.update_window(2, '\n'.join(_term.win_mgr.frames.get(2, [])))
+    def get_lines(self, begin, end):
+        #the lines of the indexed list in the range, only these items are formatted
+        _height = self.get_height()
+        _first = begin / _height
+        #cut off the over-length data so that we could show the data
+        #better in the terminal
+        _items = ['\n'.join([l[:self.term_width] for l in x.split('\n')])
+                  for x in self.blist[_first:(end + _height - 1) / _height]]
+        _lines = '\n'.join(index_list(_items, highlight = self.hl, start = _first)).split('\n')
+        return _lines[begin - _first * _height:end - _first * _height]
     def paint_indexed_list(self, title, highlight, postfix, prompt):
         self.prompt = prompt
-        _buff = index_list(self.blist, highlight = highlight)
+        self.hl = highlight
         # configure the TerminalController for display
-        self.term.set_buffer(_buff)
+        self.term.set_buffer(len(self.blist) * self.get_height(), self.get_lines)
         # limit the buffer window to half of the terminal height,
         # so that we could still show things like title, help messages etc.
         # also we limit the window width to 2/3 of the terminal window
@@ -336,6 +731,7 @@ class Ball(object):
     # including highlighting the selection etc.
     def get_selection(self, pre_input = None):
         _result = ''
+        _keyword = self.keyword # the filter in place before any keyword is typed
         if pre_input:
             _key = pre_input
             pre_input = None
@@ -346,9 +742,15 @@ class Ball(object):
                 _result = _result[:-1]
             else:
                 _result += _key
-            _hl_indexes = self.get_highlight_indexes(_result)
             self.term.win_mgr.update_window(2, self.prompt + _result + '_')
-            self.jump_to_item(_hl_indexes)
+            if _result.startswith('/f '): #narrow down the list while the keyword is typed
+                self.filter(_result[3:])
+                self.term.refresh_buffer(len(self.blist) * self.get_height())
+            elif _keyword != self.keyword: #the keyword is erased, back to where we were
+                self.filter(_keyword)
+                self.term.refresh_buffer(len(self.blist) * self.get_height())
+            else:
+                self.jump_to_item(self.get_highlight_indexes(_result))
             _key = getkey()
         return _result
     def jump_to_item(self, idx):
@@ -371,7 +773,10 @@ class Ball(object):
             try:
                 _result, _msg = func(self[x], self.name)
                 if _result is True: #user might choose not to delete
+                    if self.blist is not self.all_items: #the list is filtered
+                        self.all_items.remove(self.blist[x])
                     del self.blist[x]
+                    self.search_index = None # the positions have changed
             except LookupError:
                 _msg  = "item %d doesn't exist" % x
             print(_msg)
@@ -397,20 +802,43 @@ class BranchBall(Ball):
         _new_blist = []
         _max_bname_len = max([len(name) for name in self.blist])
         self.branch_name_title_len = _max_bname_len + 3
+        _counts = get_ahead_behind(self.blist) #all the branches in one go
         for b in self.blist:
-            _new_blist.append(get_commit_diff(b, self.branch_name_title_len))
-        self.blist = _new_blist
+            _new_blist.append(format_commit_diff(b, _counts.get(b), self.branch_name_title_len))
+        self.set_items(_new_blist)
 
 class HashBall(Ball):
     """
     A ball that holds a list of hash
+    When a GitLogStream is given, the ball is a window over the log that is
+    filled page by page, as the user asks for more hashes.
     """
-    def __init__(self, blist = [], infinite = False, since = -1, name = 'hash'):
+    def __init__(self, blist = [], infinite = False, since = -1, name = 'hash', stream = None):
+        self.stream = stream
+        if stream is not None: #only read the first page of the log
+            blist = stream.read(HASH_PAGE_SIZE)
+            infinite = not stream.finished
         #indicates whether the ball contains unbound hash info
         self.infinite = infinite
         self.since = since
-        self.original_blist = blist
-        super(HashBall, self).__init__(blist, name)
+        super(HashBall, self).__init__(list(blist), name)
+        self.term.more = self.get_more_lines
+    def load_more(self):
+        #read the next page of hashes from the log, returns the newly shown items
+        if not self.infinite:
+            return []
+        _items = self.stream.read(HASH_PAGE_SIZE)
+        self.infinite = not self.stream.finished
+        _showing_all = self.blist is self.all_items
+        self.all_items += _items
+        if _showing_all:
+            return _items
+        _new = [x for x in _items if SearchIndex.match(self.keyword.lower().split(), x)]
+        self.blist += _new
+        return _new
+    def get_more_lines(self):
+        #called by the TerminalController when paging past the end of the list
+        return len(self.load_more()) * self.get_height()
     def __getitem__(self, k): #return the hash only
         _firstline = self.blist[k].split('\n')[1]
         return _firstline.split()[-1]
@@ -418,16 +846,6 @@ class HashBall(Ball):
         exit_with_error("Deleting a hash is not allowed")
     def get_height(self):
         return 5
-    def restore_old_list(self):
-        self.blist = self.original_blist
-    def get_log_index_by_keyword(self, keyword):
-        self.blist = self.original_blist
-        self.new_blist = []
-        for l in self.blist:
-            if keyword in l:
-                self.new_blist.append(l)
-        if self.new_blist:
-            self.blist = self.new_blist
 
 
 class FileBall(Ball):
@@ -441,14 +859,35 @@ class FileBall(Ball):
             item = self.blist[i]
             if item.strip().startswith('??'): #not in git's control
                 #add the file into git
-                _file = item[item.find(' ') + 1:]
-                _file = _file.replace(' ', '\ ') # in case the file name has space
-                invoke(git.add(_file))
+                _file = get_item_paths(item)[0]
+                invoke(git.add_argv(_file))
+                if self.blist is not self.all_items: #the list is filtered
+                    self.all_items[self.all_items.index(item)] = re.sub('\?\?', 'A_', item)
                 self.blist[i] = re.sub('\?\?', 'A_', self.blist[i])
     def delete(self, item_list):
         super(FileBall, self).delete(item_list, revert_file_item)
     def get_height(self):
         return 1
+    #take the new status items of the paths (absolute), or of all the files when
+    #paths is None, keeping the changed files first and the items sorted by path
+    def update(self, items, paths = None):
+        if paths is not None:
+            _cwd = os.getcwd()
+            items = [x for x in self.all_items if not self.is_under(x, paths, _cwd)] + items
+        _changed, _untracked = get_changed_files(items)
+        _path = lambda x: x[x.find(' ') + 1:]
+        self.all_items[:] = sorted(_changed, key = _path) + sorted(_untracked, key = _path)
+        self.refresh()
+    #tell whether the file (or untracked directory) of the item is one of the
+    #paths, is under one of them or holds one of them
+    @staticmethod
+    def is_under(item, paths, cwd):
+        for _file in get_item_paths(item):
+            _file = os.path.normpath(os.path.join(cwd, _file))
+            for p in paths:
+                if _file == p or _file.startswith(p + '/') or p.startswith(_file + '/'):
+                    return True
+        return False
 
 class UrlSourceBall(Ball):
     """
@@ -475,21 +914,15 @@ class RefSourceBall(Ball):
     """
     A ball that holds and manages a list of ref sources
     """
-    def __init__(self, blist, name = 'Ref Source'):
+    def __init__(self, blist, name = 'ref'):
         self.dict = {}
         _blist = []
         for r in blist:
-            _ref, _url_index = r.split() #expected string is 'ref url_index'
+            _ref, _count = r.split() #expected string is 'ref used_count'
             _blist.append(_ref)
-            self.dict[_ref] = _url_index
+            self.dict[_ref] = int(_count)
         super(RefSourceBall, self).__init__(_blist, name)
     def delete(self, item_list):
-        for i in item_list:
-            #first decrease the ref count of the linked url item
-            _url_index = self.dict[self[i]]
-            _url = get_global('sourcelist.url.item%s' % _url_index)
-            _ref_count = int(_url.split()[1]) #TODO: what about the count is 0 here?
-            set_global('sourcelist.url.item%d' % (_ref_count - 1))
         super(RefSourceBall, self).delete(item_list, delete_source)
     def get_height(self):
         return 1
@@ -528,8 +961,537 @@ class RemoteSourceBall(Ball):
                             + '\n    url: ' + self.dict[k]['url'])
         super(RemoteSourceBall, self).__init__(_blist, name)
     def get_height(self):
-        return 1
+        return 3
+
+class GitBatch(object):
+    """
+    A long-lived 'git cat-file --batch' (or --batch-check) process.
+    Object names are written to its stdin one per line, so looking up any
+    number of objects/refs costs a single git process.
+    """
+    def __init__(self, check = False):
+        self.option = '--batch-check' if check else '--batch'
+        self.check = check
+        self.proc = None
+    def start(self):
+        if self.proc is None:
+            if DEBUG == True: #for debug only
+                print('>>> git cat-file %s <<<' % self.option)
+            self.proc = subprocess.Popen(['git', 'cat-file', self.option],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=open(os.devnull, 'w'))
+    def query(self, name):
+        #returns (sha, type, size, content), or None if the object is missing
+        if not name or '\n' in name: #cannot be passed through the batch protocol
+            return None
+        self.start()
+        try:
+            self.proc.stdin.write(name + '\n')
+            self.proc.stdin.flush()
+            _header = self.proc.stdout.readline()
+        except IOError: #the process has gone away, e.g. not in a git repository
+            self.close()
+            return None
+        if not _header:
+            self.close()
+            return None
+        _fields = _header.split()
+        if len(_fields) != 3: #'<name> missing' or '<name> ambiguous'
+            return None
+        _sha, _type, _size = _fields[0], _fields[1], int(_fields[2])
+        _content = None
+        if not self.check:
+            _content = self.proc.stdout.read(_size)
+            self.proc.stdout.read(1) #skip the LF following the content
+        return _sha, _type, _size, _content
+    def close(self):
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait()
+            except (IOError, OSError):
+                pass
+            self.proc = None
 
+class GitProcessPool(object):
+    """
+    Keeps the git helpers alive for the whole command: a cat-file --batch
+    process to read objects, a cat-file --batch-check process to resolve
+    refs/hashes, and one snapshot of the config files of all scopes.
+    Writes to the config go to the snapshot at once and are queued, the
+    queue is flushed before the next git process starts or at exit.
+    """
+    def __init__(self):
+        self.batch = GitBatch()
+        self.batch_check = GitBatch(check = True)
+        self.config = None #scope => {normalized key: [values, in the order git reads them]}
+        self.pending = [] #queued 'git config' commands, in order
+    def read_object(self, name):
+        return self.batch.query(name)
+    def check_object(self, name):
+        return self.batch_check.query(name)
+    def load_config(self):
+        if self.config is None:
+            _cmd = ['git', 'config', '--list', '-z', '--show-scope']
+            if DEBUG == True: #for debug only
+                print('>>> %s <<<' % ' '.join(_cmd))
+            _proc = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            _out, _err = _proc.communicate()
+            self.config = {}
+            #every entry is 'scope\0key\nvalue\0', a key without value is a boolean
+            _fields = _out.split('\0')
+            for _scope, _entry in zip(_fields[0::2], _fields[1::2]):
+                _key, _sep, _value = _entry.partition('\n')
+                self.config.setdefault(_scope, {}).setdefault(_key, []).append(
+                    _value if _sep else 'true')
+        return self.config
+    #the last value of the key wins, like 'git config --get'
+    def get_config(self, scope, element):
+        _values = self.load_config().get(scope, {}).get(normalize_config_key(element))
+        return _values[-1] if _values else None
+    #the 'key value' lines of the keys matching the pattern, like 'git config --get-regexp'
+    def find_config(self, pattern):
+        _lines = []
+        for _scope in ['system', 'global', 'local', 'worktree']:
+            for _key, _values in sorted(self.load_config().get(_scope, {}).items()):
+                if re.search(pattern, _key):
+                    _lines += ['%s %s' % (_key, x) for x in _values]
+        return ''.join([x + '\n' for x in _lines]) #every line ends with a newline, as git prints it
+    def set_config(self, scope, element, value):
+        _key = normalize_config_key(element)
+        _snapshot = self.load_config().setdefault(scope, {})
+        if _snapshot.get(_key) == [value]:
+            return #nothing changes
+        if value == '': #an empty value removes the key
+            if _key not in _snapshot:
+                return
+            del _snapshot[_key]
+        else:
+            _snapshot[_key] = [value] #all the values are replaced
+        #only the last write to a key matters
+        self.pending = [x for x in self.pending if x[:2] != (scope, _key)]
+        self.pending.append((scope, _key, git.config_argv(type = scope, element = element,
+                                                          value = value)))
+    def remove_config_section(self, scope, section):
+        _prefix = normalize_config_key(section + '.x')[:-1]
+        _snapshot = self.load_config().setdefault(scope, {})
+        _keys = [x for x in _snapshot if x.startswith(_prefix)]
+        if not _keys:
+            return #nothing to remove
+        for _key in _keys:
+            del _snapshot[_key]
+        self.pending = [x for x in self.pending
+                        if not (x[0] == scope and x[1].startswith(_prefix))]
+        self.pending.append((scope, _prefix, git.config_argv(type = scope, section = section,
+                                                             value = '')))
+    def flush_config(self):
+        _pending, self.pending = self.pending, []
+        for _scope, _key, _cmd in _pending:
+            invoke(_cmd)
+    def close(self):
+        self.flush_config()
+        self.batch.close()
+        self.batch_check.close()
+
+class RepoContext(object):
+    """
+    What a command keeps asking about the repository it works in: the top
+    level and .git directories, HEAD, the current branch and its upstream
+    (the remote-tracking ref it follows) and remote. Every fact is probed
+    once and kept until a git command that may change it is invoked (see
+    CHANGES), its branch config is written, or the working directory changes.
+    """
+    BRANCH_FACTS = ['head', 'branch', 'upstream', 'remote']
+    #git command => the facts it may change; a fetch only moves remote-tracking
+    #refs, which are not kept here
+    CHANGES = {'checkout': BRANCH_FACTS, 'switch': BRANCH_FACTS, 'rebase': BRANCH_FACTS,
+               'pull': BRANCH_FACTS, 'branch': BRANCH_FACTS,
+               'commit': ['head'], 'merge': ['head'], 'reset': ['head'], 'am': ['head'],
+               'cherry-pick': ['head'], 'revert': ['head'], 'update-ref': ['head'],
+               'config': ['upstream', 'remote'], 'remote': ['upstream', 'remote'],
+               'init': None, 'clone': None} #None: everything
+    def __init__(self):
+        self.facts = {}
+        self.cwd = None
+    def get(self, fact):
+        _cwd = os.getcwd()
+        if _cwd != self.cwd: #another repository, maybe
+            self.facts = {}
+            self.cwd = _cwd
+        if fact not in self.facts:
+            self.facts[fact] = getattr(self, 'probe_' + fact)()
+        return self.facts[fact]
+    def forget(self, facts = None):
+        if facts is None:
+            self.facts = {}
+        for x in facts or []:
+            self.facts.pop(x, None)
+    #forget what the command, an argument list or a shell command line, may change
+    def update(self, cmd):
+        _args = cmd if isinstance(cmd, list) else cmd.split()
+        if 'git' not in _args:
+            return
+        _args = _args[_args.index('git') + 1:]
+        while _args and _args[0].startswith('-'): #options of git itself
+            _args = _args[2:] if _args[0] in ['-c', '-C'] else _args[1:]
+        if _args and _args[0] in self.CHANGES:
+            self.forget(self.CHANGES[_args[0]])
+    def probe_toplevel(self):
+        _tmp = invoke(git.revparse_argv(param = ['--show-toplevel']))
+        return None if _tmp.startswith('fatal:') else _tmp.strip(' \n')
+    def probe_gitdir(self):
+        _dir = find_git_dir(self.cwd)
+        if _dir is not None:
+            return _dir
+        _tmp = invoke(git.revparse_argv(param = ['--git-dir']))
+        return None if _tmp.startswith('fatal:') else os.path.abspath(_tmp.strip(' \n'))
+    def probe_head(self):
+        _head = GIT_POOL.check_object('HEAD')
+        return _head[0] if _head else None
+    def probe_branch(self):
+        #HEAD is 'ref: refs/heads/<branch>', or the commit it is detached at
+        _gitdir = self.get('gitdir')
+        if _gitdir is None:
+            return None
+        try:
+            with open(os.path.join(_gitdir, 'HEAD')) as f:
+                _head = f.read().strip()
+        except IOError:
+            _head = ''
+        if _head.startswith('ref: refs/heads/') and _head != 'ref: refs/heads/.invalid':
+            return _head[len('ref: refs/heads/'):]
+        if re.match('^[0-9a-f]{40}([0-9a-f]{24})?$', _head):
+            return _head #the full object name, a short one may be ambiguous when used as a rev
+        #HEAD is not kept in a plain file (e.g. the reftable backend), ask git
+        _branch = invoke(git.symbolicref_argv(param = ['-q', '--short'])).strip()
+        return _branch or invoke(git.revparse_argv(hash = 'HEAD')).strip()
+    def probe_remote(self):
+        return get_remote(self.get('branch'))
+    def probe_upstream(self):
+        try:
+            _remote_branch = get_local('branch.%s.merge' % self.get('branch'))
+            _fetch = get_local('remote.%s.fetch' % self.get('remote'))
+        except ConfigItemMissing:
+            return None
+        _remote_copy, _local_copy = _fetch.split(':')
+        if '*' in _local_copy: #this is a path with wildcard
+            _remote_copy = _remote_copy.strip('*+')
+            _local_copy = _local_copy.strip('*')
+            return _remote_branch.replace(_remote_copy, _local_copy)
+        else: #this is the exact path to the remote branch
+            return _local_copy
+
+class SourceStore(object):
+    """
+    The remembered url/ref sources and how many times each has been used,
+    kept in an append-only file in the user's config directory. Every line
+    is one change: 'add<TAB>type<TAB>item', 'count<TAB>type<TAB>item<TAB>n'
+    or 'del<TAB>type<TAB>item'. The file is read once and replayed into a
+    dict per type; it is rewritten when most of its lines are stale.
+    """
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.sources = None #type => OrderedDict of item => count
+    def load(self):
+        if self.sources is not None:
+            return
+        self.sources = {}
+        if not os.path.isfile(self.path):
+            self.migrate()
+            return
+        _lines = 0
+        with open(self.path) as f:
+            for line in f:
+                _fields = line.rstrip('\n').split('\t')
+                _lines += 1
+                if len(_fields) < 3:
+                    continue #a line cut short, e.g. by a full disk
+                _items = self.sources.setdefault(_fields[1], collections.OrderedDict())
+                if _fields[0] == 'add':
+                    _items.setdefault(_fields[2], 0)
+                elif _fields[0] == 'count' and len(_fields) == 4:
+                    _items[_fields[2]] = int(_fields[3])
+                elif _fields[0] == 'del':
+                    _items.pop(_fields[2], None)
+        if _lines > 2 * sum([len(x) for x in self.sources.values()]) + 100:
+            self.compact()
+    #the sources used to be kept as sourcelist.<type>.itemN keys in the global config
+    def migrate(self):
+        for _type in ['url', 'ref']:
+            _items = self.sources.setdefault(_type, collections.OrderedDict())
+            _len = get_global('sourcelist.%s.length' % _type)
+            for i in range(int(_len) if _len else 0):
+                _tmp = get_global('sourcelist.%s.item%d' % (_type, i + 1)).split()
+                if _tmp: #deleted items were left as empty keys
+                    _items[_tmp[0]] = int(_tmp[1]) if len(_tmp) > 1 else 0
+        self.compact()
+        for _type in ['url', 'ref']:
+            remove_global('sourcelist.%s' % _type)
+    def compact(self):
+        _dir = os.path.dirname(self.path)
+        if not os.path.isdir(_dir):
+            os.makedirs(_dir)
+        with open(self.path + '.tmp', 'w') as f:
+            for _type, _items in self.sources.items():
+                for _item, _count in _items.items():
+                    f.write('add\t%s\t%s\n' % (_type, _item))
+                    if _count:
+                        f.write('count\t%s\t%s\t%d\n' % (_type, _item, _count))
+        os.rename(self.path + '.tmp', self.path)
+    def append(self, *fields):
+        with open(self.path, 'a') as f:
+            f.write('\t'.join(fields) + '\n')
+    def get(self, type):
+        self.load()
+        return self.sources.setdefault(type, collections.OrderedDict())
+    def add(self, type, item):
+        if item not in self.get(type):
+            self.get(type)[item] = 0
+            self.append('add', type, item)
+    def increment(self, type, item):
+        self.get(type)[item] += 1
+        self.append('count', type, item, str(self.get(type)[item]))
+    def delete(self, type, item):
+        if item not in self.get(type):
+            return False
+        del self.get(type)[item]
+        self.append('del', type, item)
+        return True
+
+class MaintenanceDaemon(object):
+    """
+    One background process per user that keeps the registered repositories
+    up to date: at the daily times set for a repository (core.UpdateTime) it
+    fetches, writes the commit-graph and runs 'git gc --auto' there. The due
+    times get some jitter, at most DAEMON_JOBS repositories are worked on at
+    once, and the process sleeps until the next due time. Its files live in
+    one directory: 'repos' (JSON, repository => list of [h, m, s]), 'pid',
+    'status' (JSON, repository => next due time and the last result of every
+    task) and 'log'. SIGHUP makes it read 'repos' again, SIGTERM stops it.
+    """
+    TASKS = [('fetch', git.fetch_argv()),
+             ('commit-graph', ['git', 'commit-graph', 'write', '--reachable']),
+             ('gc', ['git', 'gc', '--auto'])]
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+    def file(self, name):
+        return os.path.join(self.path, name)
+    def read(self, name):
+        import json
+        try:
+            with open(self.file(name)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+    def write(self, name, data):
+        import json
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with open(self.file(name) + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.rename(self.file(name) + '.tmp', self.file(name))
+    def register(self, repo, times):
+        _repos = self.read('repos')
+        _repos[repo] = times
+        self.write('repos', _repos)
+        self.signal(signal.SIGHUP)
+    def unregister(self, repo):
+        _repos = self.read('repos')
+        if _repos.pop(repo, None) is None:
+            return False
+        self.write('repos', _repos)
+        self.signal(signal.SIGHUP)
+        return True
+    def get_pid(self):
+        try:
+            with open(self.file('pid')) as f:
+                _pid = int(f.read())
+            os.kill(_pid, 0) #the daemon may have died without cleaning up
+        except (IOError, ValueError, OSError):
+            return None
+        return _pid
+    def signal(self, sig):
+        _pid = self.get_pid()
+        if _pid:
+            os.kill(_pid, sig)
+        return _pid
+    def start(self):
+        if self.get_pid():
+            return
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        #a cat-file helper still reading from a pipe the daemon holds would never see EOF
+        GIT_POOL.close()
+        _pid = os.fork()
+        if _pid > 0:
+            os.waitpid(_pid, 0)
+            return
+        #detach from the terminal, the grandchild is the daemon
+        os.setsid()
+        if os.fork() > 0:
+            os._exit(0)
+        try:
+            os.chdir('/')
+            _null = os.open(os.devnull, os.O_RDWR)
+            _log = os.open(self.file('log'), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+            os.dup2(_null, 0)
+            os.dup2(_log, 1)
+            os.dup2(_log, 2)
+            os.close(_null)
+            os.close(_log)
+            #nothing the command had open may be kept open by the daemon
+            os.closerange(3, os.sysconf('SC_OPEN_MAX'))
+            with open(self.file('pid'), 'w') as f:
+                f.write('%d\n' % os.getpid())
+            self.run()
+        except Exception:
+            import traceback
+            traceback.print_exc() #into the log, nobody else would see it
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(0) #never go back to the command that started us
+    #the next time after now one of the daily times comes, plus the jitter
+    def next_due(self, times, now):
+        import datetime, random
+        _today = datetime.datetime.fromtimestamp(now).replace(hour = 0, minute = 0,
+                                                              second = 0, microsecond = 0)
+        _due = []
+        for h, m, s in times:
+            _time = _today + datetime.timedelta(hours = h, minutes = m, seconds = s)
+            if time.mktime(_time.timetuple()) <= now:
+                _time += datetime.timedelta(days = 1)
+            _due.append(time.mktime(_time.timetuple()))
+        return min(_due) + random.uniform(0, DAEMON_JITTER)
+    def run(self):
+        import threading
+        self.stopping = False
+        self.reloading = True
+        self.times = {} #repository => its daily times, as last read from 'repos'
+        self.status = self.read('status')
+        self.lock = threading.Lock() #guards self.status
+        _workers = {} #repository => thread working on it
+        _due = {} #repository => next due time
+        def _on_term(sig, frame):
+            self.stopping = True
+        def _on_hup(sig, frame):
+            self.reloading = True
+        signal.signal(signal.SIGTERM, _on_term)
+        signal.signal(signal.SIGHUP, _on_hup)
+        print('%s daemon %d started' % (time.ctime(), os.getpid()))
+        sys.stdout.flush()
+        while not self.stopping:
+            _now = time.time()
+            if self.reloading:
+                self.reloading = False
+                _repos = self.read('repos')
+                for _repo in _due.keys():
+                    if _repo not in _repos:
+                        del _due[_repo]
+                for _repo, _times in _repos.items():
+                    if _repo not in _due or self.times.get(_repo) != _times:
+                        _due[_repo] = self.next_due(_times, _now)
+                self.times = _repos
+            for _repo, _thread in _workers.items():
+                if not _thread.is_alive():
+                    del _workers[_repo]
+            #start the due repositories, the ones waiting longest first
+            for _time, _repo in sorted([(y, x) for x, y in _due.items()]):
+                if _time > _now or len(_workers) >= DAEMON_JOBS:
+                    break
+                if _repo in _workers:
+                    continue
+                _due[_repo] = self.next_due(self.times[_repo], _now)
+                _workers[_repo] = threading.Thread(target = self.work, args = (_repo,))
+                _workers[_repo].daemon = True
+                _workers[_repo].start()
+            with self.lock:
+                for _repo in self.status.keys():
+                    if _repo not in _due:
+                        del self.status[_repo]
+                for _repo, _time in _due.items():
+                    self.status.setdefault(_repo, {})['next'] = _time
+                self.write('status', self.status)
+            if _workers and min(_due.values()) <= _now:
+                _sleep = 1 #wait for a free slot
+            elif _due:
+                _sleep = min(_due.values()) - _now
+            else:
+                _sleep = 3600
+            #signals cut the sleep short; wake up now and then in case the clock jumps
+            time.sleep(max(0, min(_sleep, 3600)))
+        try:
+            os.remove(self.file('pid'))
+        except OSError:
+            pass
+        print('%s daemon %d stopped' % (time.ctime(), os.getpid()))
+    def work(self, repo):
+        for _task, _argv in self.TASKS:
+            if not os.path.isdir(repo):
+                _result = 'missing'
+            else:
+                with open(os.devnull, 'w') as _null:
+                    _code = subprocess.call(_argv, cwd = repo, stdin = _null,
+                                            stdout = _null, stderr = sys.stderr)
+                _result = 'ok' if _code == 0 else 'error %d' % _code
+            print('%s %s %s: %s' % (time.ctime(), repo, _task, _result))
+            sys.stdout.flush()
+            with self.lock:
+                self.status.setdefault(repo, {})[_task] = [time.time(), _result]
+                self.write('status', self.status)
+            if _task == 'fetch' and _result != 'ok':
+                break #nothing new to maintain
+
+class ColorTable(dict):
+    """
+    The escape codes used by paint. The table is filled on first use so that
+    the GitTool.ColorSupport setting is only read when something is painted.
+    """
+    def load(self):
+        if not dict.__len__(self):
+            _plain = get_global('GitTool.ColorSupport') == 'no'
+            self.update(PLAIN_CODES if _plain else COLOR_CODES)
+    def __getitem__(self, key):
+        self.load()
+        return dict.__getitem__(self, key)
+    def keys(self):
+        self.load()
+        return dict.keys(self)
+
+class GitLogStream(object):
+    """
+    Reads the records of a 'git log -z' lazily, page by page.
+    git blocks on the pipe once we stop reading, so only the pages we
+    actually show are ever produced.
+    """
+    def __init__(self, argv):
+        self.proc = invoke_stream(argv)
+        self.pending = ''
+        self.finished = False
+    def read(self, num):
+        _records = []
+        while len(_records) < num and not self.finished:
+            _end = self.pending.find('\0')
+            if _end != -1:
+                _records.append(self.pending[:_end])
+                self.pending = self.pending[_end + 1:]
+                continue
+            _chunk = os.read(self.proc.stdout.fileno(), 65536)
+            if _chunk:
+                self.pending += _chunk
+            else: #end of the log
+                if self.pending.strip('\n'):
+                    _records.append(self.pending.rstrip('\n'))
+                self.pending = ''
+                self.close()
+        return _records
+    def close(self):
+        if not self.finished:
+            self.finished = True
+            self.proc.stdout.close()
+            if self.proc.poll() is None:
+                self.proc.terminate()
+            self.proc.wait()
 
 class GITError(Exception):
     """base class of all GitTool error exceptions"""
@@ -562,21 +1524,16 @@ def paint(text_color, str):
 # to capture a keypress, in Linux
 def capture_keypress():
     a = [0, 0, 0, 0, 0, 0]
-    try:
-        os.system('stty -icanon')
-        os.system('stty -echo')
-        a[0]=ord(sys.stdin.read(1))
+    with TERM_SESSION as _input:
+        a[0]=ord(_input.read_byte())
         if a[0]==27:
-            a[1]=ord(sys.stdin.read(1))
+            a[1]=ord(_input.read_byte())
             if a[1]==91:
-                a[2]=ord(sys.stdin.read(1))
+                a[2]=ord(_input.read_byte())
                 if (a[2]>=49 and a[2]<=54) or a[2]==91:
-                    a[3]=ord(sys.stdin.read(1))
+                    a[3]=ord(_input.read_byte())
                     if a[3]>=48 and a[3]<=57:
-                        a[4]=ord(sys.stdin.read(1))
-    finally:
-        os.system('stty echo')
-        os.system('stty icanon')
+                        a[4]=ord(_input.read_byte())
     if a==[ 10, 0, 0, 0, 0, 0]: k = "Enter"         #13
     elif a==[ 27, 27, 0, 0, 0, 0]: k = "TwiceEsc"   #27
     elif a==[ 27, 91, 91, 65, 0, 0]: k = "F1"       #1059
@@ -617,46 +1574,73 @@ def allperm(inputstr):
 def split(str, sep = None):
     return str.split(sep) if str else []
 
+def plural(num, unit):
+    return '%d %s%s' % (num, unit, '' if num == 1 else 's')
+
+#the same as git's relative date format, e.g. '3 weeks ago'
+def relative_date(timestamp, now = None):
+    _diff = int((now if now else time.time()) - timestamp)
+    if _diff < 0:
+        return 'in the future'
+    if _diff < 90:
+        return plural(_diff, 'second') + ' ago'
+    _diff = (_diff + 30) / 60 #minutes
+    if _diff < 90:
+        return plural(_diff, 'minute') + ' ago'
+    _diff = (_diff + 30) / 60 #hours
+    if _diff < 36:
+        return plural(_diff, 'hour') + ' ago'
+    _diff = (_diff + 12) / 24 #days
+    if _diff < 14:
+        return plural(_diff, 'day') + ' ago'
+    if _diff < 70:
+        return plural((_diff + 3) / 7, 'week') + ' ago'
+    if _diff < 365:
+        return plural((_diff + 15) / 30, 'month') + ' ago'
+    if _diff < 1825:
+        _total_months = (_diff * 12 * 2 + 365) / (365 * 2)
+        _years, _months = _total_months / 12, _total_months % 12
+        if _months:
+            return '%s, %s ago' % (plural(_years, 'year'), plural(_months, 'month'))
+        return plural(_years, 'year') + ' ago'
+    return plural((_diff + 183) / 365, 'year') + ' ago'
+
+#the same as git's iso date format, e.g. '2012-12-26 10:00:00 +0800'
+def format_iso_date(timestamp, offset):
+    import datetime
+    _date = datetime.datetime.utcfromtimestamp(timestamp + offset)
+    return _date.strftime('%Y-%m-%d %H:%M:%S ') + '%s%02d%02d' % ('-' if offset < 0 else '+',
+                                                                   abs(offset) / 3600,
+                                                                   abs(offset) % 3600 / 60)
+
+#the DECTCEM sequences understood by xterm-like terminals and the linux console
 def hide_cursor():
-    if sys.platform == 'darwin':
-        os.system('echo "\033[?25l"')
-    elif sys.platform == 'linux':
-        os.system('setterm -cursor off')
-    elif sys.platform == 'Windows':
-        pass #i don't know how to do this in Windows
+    if sys.stdout.isatty():
+        sys.stdout.write('\033[?25l')
+        sys.stdout.flush()
 
 def show_cursor():
-    if sys.platform == 'darwin':
-        os.system('echo "\033[?25h"')
-    elif sys.platform == 'linux':
-        os.system('setterm -cursor on')
-    elif sys.platform == 'Windows':
-        pass #i don't know how to do this in Windows
+    if sys.stdout.isatty():
+        sys.stdout.write('\033[?25h')
+        sys.stdout.flush()
 
 # to get a pressed key without the 'enter'
 def getkey():
-    TERMIOS = termios
-    fd = sys.stdin.fileno()
-    old = termios.tcgetattr(fd)
-    new = termios.tcgetattr(fd)
-    new[3] = new[3] & ~TERMIOS.ICANON & ~TERMIOS.ECHO
-    new[6][TERMIOS.VMIN] = 1
-    new[6][TERMIOS.VTIME] = 0
-    termios.tcsetattr(fd, TERMIOS.TCSANOW, new)
-    c = None
-    try:
-        c = os.read(fd, 1)
-    finally:
-        termios.tcsetattr(fd, TERMIOS.TCSAFLUSH, old)
-    return c
+    with TERM_SESSION as _input:
+        return _input.read_byte()
 
 #invoke bash commands
+#a command given as an argument list (see the *_argv builders in gitcommand)
+#is executed directly, without starting a shell for it
 def invoke(cmd, detached = False, need_error_and_out = False):
+    GIT_POOL.flush_config() #the command may read the config we have changed
+    REPO.update(cmd) #what the command may change is probed again next time
+    _shell = not isinstance(cmd, list)
     if DEBUG == True: #for debug only
-        print('>>> %s <<<' % cmd)
+        print('>>> %s <<<' % (cmd if _shell else ' '.join(cmd)))
     if detached is False:
-        execution=subprocess.Popen([cmd],
-                                   shell=True, stdin=subprocess.PIPE,
+        execution=subprocess.Popen([cmd] if _shell else cmd,
+                                   shell=_shell, stdin=subprocess.PIPE,
                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         o=execution.communicate()
         if need_error_and_out: #return both stdout and stderr
@@ -667,9 +1651,19 @@ def invoke(cmd, detached = False, need_error_and_out = False):
             if o[0]: #only return the std result, when there is no error
                 return o[0]
     else: #invoke bash commands in separate process, no error return
-        subprocess.Popen(cmd.split(), stderr=subprocess.PIPE)
+        subprocess.Popen(cmd.split() if _shell else cmd, stderr=subprocess.PIPE)
     return ""
 
+#start a git command given as an argument list and return the process,
+#so that its output can be read while it is running
+def invoke_stream(cmd, stdin = False):
+    GIT_POOL.flush_config() #the command may read the config we have changed
+    REPO.update(cmd)
+    if DEBUG == True: #for debug only
+        print('>>> %s <<<' % ' '.join(cmd))
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE if stdin else None,
+                            stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'))
+
 def get_indexes(line, operator = ''):
     #space, '-' or ',' is used as separator
     if re.search('^' + operator + '\s*\d+([\s,-]+\d+)*\s*$', line):
@@ -698,11 +1692,12 @@ def get_answer(title = [], prompt = '', postfix = '', default = None,
             # we are drawing everything ourselves, so hide the system
             # cursor (we will draw a 'fake' one)
             hide_cursor()
-            _user_input = ball.paint_indexed_list(title,
-                                                  hl,
-                                                  postfix,
-                                                  prompt + _ps)
-            _ans = ball.get_selection(_user_input)
+            with TERM_SESSION: #the keys are read one by one until the answer is complete
+                _user_input = ball.paint_indexed_list(title,
+                                                      hl,
+                                                      postfix,
+                                                      prompt + _ps)
+                _ans = ball.get_selection(_user_input)
             show_cursor()
         else:
             _ans = raw_input(prompt + _ps).strip()
@@ -738,6 +1733,11 @@ def get_answer(title = [], prompt = '', postfix = '', default = None,
                     hl += 1
             if not loop: #quit looping, the caller will call again with updated data
                 return ''
+        elif _ans.startswith('/f') and ball: # to show only the matching items
+            if not ball.filter(_ans[2:]):
+                print("nothing matches '%s'" % _ans[2:].strip())
+                ball.filter(None)
+            hl = None
         elif _ans.startswith('/m') or _ans.startswith('/f'):
             return [_ans]
         elif ball:
@@ -756,9 +1756,9 @@ def get_answer(title = [], prompt = '', postfix = '', default = None,
             ball.term.reset_window()
 
 #show a list of items with index and one of the item highlighted
-def index_list(_list, index_color = 'none', highlight = -1, hl_color = 'red'):
+def index_list(_list, index_color = 'none', highlight = -1, hl_color = 'red', start = 0):
     return [ paint(hl_color if index == highlight else index_color, '%d >> ' % index) +
-             x for (index, x) in zip(range(0, len(_list)), _list)]
+             x for (index, x) in zip(range(start, start + len(_list)), _list)]
 
 #this function will expand strings like '1-3' to '1 2 3'
 def expand_indexes_from_range(obj):
@@ -769,23 +1769,6 @@ def expand_indexes_from_range(obj):
         _tmp += ' %d ' % x
     return _tmp
 
-#used in re.sub to fill the commit index in graphical commit tree
-def fill_commit_index(obj):
-    global commit_index
-    commit_index += 1
-    return obj.group() + ' [' + str(commit_index) + '] '
-
-#used in re.sub to modify the matching string and link nodes with arrows
-def build_merge_arrows(obj):
-    _tmp = ''
-    _line = obj.group()
-    _from = _line[1:8]
-    _list = re.findall('[a-f0-9]{7}', _line[7:])
-    for x in _list:
-        _tmp += '"%(v)s":f0 -> "%(f)s":f0 [color=blue style=bold arrowhead=vee]\n' %\
-                {'f':_from, 'v':x}
-    return _tmp
-
 #print the header of status result
 def make_status_header(ver1, ver2):
     return '[' + paint('red', ver1) + ']' + ' ==> ' +\
@@ -855,13 +1838,15 @@ def convert_relative_path(path, root_path, cur_path):
     else:
         return re.sub('^%s' % cur_path, '', abs_path)
 
-def process_git_diff_stat(raw):
+#sum up the 'git diff --numstat' lines per top directory,
+#the lines could be any iterable, e.g. the stdout of a git process
+def process_git_diff_stat(lines):
     git_path = root_path()
     cur_path = os.getcwd()
     if git_path is None:
         exit_with_error("You are not in a Git repository")
     result = {}
-    for line in [x.strip() for x in raw.split('\n')]:
+    for line in (x.strip() for x in lines):
         if line == '':
             continue
         _tmp = line.split()
@@ -873,7 +1858,7 @@ def process_git_diff_stat(raw):
         _top_path = re.search('^[^/]+[/]*', _relative_path).group()
         if '-' == _add or '-' == _delete:# this is a binary file change, ignore
             continue
-        if _top_path in result.keys():
+        if _top_path in result:
             result[_top_path][0] += int(_add)
             result[_top_path][1] += int(_delete)
         else:
@@ -903,7 +1888,7 @@ def select_branch(isremote = False):
 
 def make_branch(branch, track_info = None):
     _parent_branch = get_current_branch()
-    _tmp = invoke(git.branch(branch = branch, upstream = track_info)) #create branch with the name given
+    _tmp = invoke(git.branch_argv(branch = branch, upstream = track_info)) #create branch with the name given
     _tmp = do_checkout_branch(target = branch) #to switch to the new branch
     _result = 'created and switched to new branch: ' + paint('red', branch) + '\n'
     copy_branch_config(branch, _parent_branch)
@@ -928,51 +1913,236 @@ def link_branch_to_ref(bname, cur_branch, ref, local_ref, repo = ''):
     # the merge value for master branch is the remote path in the fetch section: +xx:
 
 def get_branches_with_commit(hash):
-    _cmd = git.branch(contains = hash)
+    _cmd = git.branch_argv(contains = hash)
     return [x.strip(' *') for x in split(invoke(_cmd), '\n') if x]
 
+#get the commits the local branches and the tags point to
+#returns a list of (ref name, commit), annotated tags are peeled to their commits
+def get_ref_tips():
+    _format = '%(objectname) %(objecttype) %(*objectname) %(*objecttype) %(refname)'
+    _refs = []
+    for line in split(invoke(git.foreachref_argv(format = _format,
+                                                 pattern = ['refs/heads', 'refs/tags'])), '\n'):
+        _fields = line.split()
+        if len(_fields) == 5 and _fields[3] == 'commit': #an annotated tag
+            _refs.append((_fields[4], _fields[2]))
+        elif len(_fields) == 3 and _fields[1] == 'commit':
+            _refs.append((_fields[2], _fields[0]))
+    return _refs
+
+#the containment index remembers which refs contain a commit, it is only valid
+#as long as none of the ref tips has moved
+def load_ref_contains_index(fingerprint):
+    _index = {}
+    _path = gittool_file('ref_contains')
+    if _path and os.path.isfile(_path):
+        with open(_path) as f:
+            if f.readline().strip() != fingerprint: #the refs have changed since
+                return _index
+            for line in f:
+                _hash, _branches, _tags = line.rstrip('\n').split('\t')
+                _index[_hash] = (split(_branches), split(_tags))
+    return _index
+
+def save_ref_contains_index(fingerprint, index):
+    _path = gittool_file('ref_contains')
+    if _path is None:
+        return
+    try:
+        with open(_path + '.tmp', 'w') as f:
+            f.write(fingerprint + '\n')
+            for _hash, (_branches, _tags) in index.iteritems():
+                f.write('%s\t%s\t%s\n' % (_hash, ' '.join(_branches), ' '.join(_tags)))
+        os.rename(_path + '.tmp', _path)
+    except (IOError, OSError):
+        pass #the index is only an optimization
+
+#find the branches and tags containing each of the given commits (full hashes)
+#with one 'git rev-list --topo-order' walk from all the ref tips: every commit
+#passes the set of refs reaching it on to its parents, and the walk stops as
+#soon as all the given commits are reached.
+#returns {commit: (branch names, tag names)}
+def get_refs_containing(commits, refs = None):
+    import hashlib
+    _refs = refs if refs is not None else get_ref_tips()
+    _fingerprint = hashlib.sha1('\n'.join(sorted('%s %s' % x for x in _refs))).hexdigest()
+    _index = load_ref_contains_index(_fingerprint)
+    _left = set(c for c in commits if c not in _index)
+    if _left and _refs:
+        _tip_mask = {}
+        for i, (_name, _commit) in enumerate(_refs):
+            _tip_mask[_commit] = _tip_mask.get(_commit, 0) | (1 << i)
+        _proc = invoke_stream(git.revlist_argv(param = ['--topo-order', '--parents', '--stdin']),
+                              stdin = True)
+        _proc.stdin.write('\n'.join(_tip_mask.keys()) + '\n')
+        _proc.stdin.close()
+        _pending = {} #commit => refs reaching it through the children walked so far
+        for line in _proc.stdout:
+            _hashes = line.split()
+            _mask = _pending.pop(_hashes[0], 0) | _tip_mask.get(_hashes[0], 0)
+            for _parent in _hashes[1:]:
+                _pending[_parent] = _pending.get(_parent, 0) | _mask
+            if _hashes[0] in _left:
+                _names = [_refs[i][0] for i in xrange(len(_refs)) if _mask >> i & 1]
+                _index[_hashes[0]] = (sorted(x[11:] for x in _names if x.startswith('refs/heads/')),
+                                      sorted(x[10:] for x in _names if x.startswith('refs/tags/')))
+                _left.discard(_hashes[0])
+                if not _left: #no need to walk any further
+                    break
+        _proc.stdout.close()
+        if _proc.poll() is None:
+            _proc.terminate()
+        _proc.wait()
+        for c in _left: #not reachable from any of the refs
+            _index[c] = ([], [])
+        save_ref_contains_index(_fingerprint, _index)
+    return dict((c, _index.get(c, ([], []))) for c in commits)
+
+#the upstream of a branch: the branch with the same name in origin
+def get_upstream_ref(branch):
+    _remote_branch = get_merge(branch)
+    if _remote_branch is None:
+        return None
+    return 'refs/remotes/origin' + _remote_branch[ _remote_branch.rfind('/'):]
+
+#the ahead/behind counts are cached per branch against the tips of the branch and
+#its upstream, so an unchanged branch costs nothing the next time
+#returns {branch: ((tip, upstream tip), (ahead, behind))}
+def load_ahead_behind_cache():
+    _cache = {}
+    _path = gittool_file('ahead_behind')
+    if _path and os.path.isfile(_path):
+        with open(_path) as f:
+            for line in f:
+                _fields = line.split()
+                if len(_fields) == 5:
+                    _cache[_fields[0]] = ((_fields[1], _fields[2]),
+                                          (int(_fields[3]), int(_fields[4])))
+    return _cache
+
+def save_ahead_behind_cache(cache):
+    _path = gittool_file('ahead_behind')
+    if _path is None:
+        return
+    try:
+        with open(_path + '.tmp', 'w') as f:
+            for b, ((_tip, _upstream_tip), (_ahead, _behind)) in cache.iteritems():
+                f.write('%s %s %s %d %d\n' % (b, _tip, _upstream_tip, _ahead, _behind))
+        os.rename(_path + '.tmp', _path)
+    except (IOError, OSError):
+        pass #the cache is only an optimization
+
+#count the commits in each branch but not in its upstream, and the other way around.
+#uncached pairs are counted by 'git rev-list --left-right --count', running
+#AHEAD_BEHIND_JOBS of them at the same time.
+#returns {branch: (ahead, behind)}, branches without an upstream are left out
+def get_ahead_behind(branches):
+    _cache = load_ahead_behind_cache()
+    _keys, _todo, _counted = {}, [], {}
+    for b in branches:
+        _upstream = get_upstream_ref(b)
+        _tip = GIT_POOL.check_object('refs/heads/%s' % b)
+        _upstream_tip = GIT_POOL.check_object(_upstream) if _upstream else None
+        if _tip is None or _upstream_tip is None:
+            continue
+        _keys[b] = (_tip[0], _upstream_tip[0])
+        if b in _cache and _cache[b][0] == _keys[b]:
+            _counted[_keys[b]] = _cache[b][1]
+        elif _keys[b] not in _todo:
+            _todo.append(_keys[b])
+    _running = []
+    while _todo or _running:
+        while _todo and len(_running) < AHEAD_BEHIND_JOBS:
+            _key = _todo.pop()
+            _cmd = git.revlist_argv(revs = ['%s...%s' % _key],
+                                    param = ['--left-right', '--count', '--no-merges'])
+            _running.append((_key, invoke_stream(_cmd)))
+        _key, _proc = _running.pop(0)
+        _counts = _proc.communicate()[0].split()
+        if len(_counts) == 2:
+            _counted[_key] = (int(_counts[0]), int(_counts[1]))
+    _result = {}
+    _updated = False
+    for b, _key in _keys.iteritems():
+        if _key in _counted:
+            _result[b] = _counted[_key]
+            if _cache.get(b) != (_key, _counted[_key]):
+                _cache[b] = (_key, _counted[_key])
+                _updated = True
+    if _updated:
+        save_ahead_behind_cache(_cache)
+    return _result
+
 #return a colored string showing the difference in commits
 #between the given branch and its upstream branch
-def get_commit_diff(branch, branch_name_len):
-    try:
-        _remote_branch = get_merge(branch)
-        _upstream = 'refs/remotes/origin' + _remote_branch[ _remote_branch.rfind('/'):]
-        _branch_only_commits = invoke(git.log(hash = '%s ^%s' % (branch, _upstream),
-                                              param = '--no-merges --oneline'))
-        _upstream_only_commits = invoke(git.log(hash = '%s ^%s' % (_upstream, branch),
-                                              param = '--no-merges --oneline'))
-        _branch_only_number = paint('green', '+%d' % (_branch_only_commits.count('\n')
-                                                      if _branch_only_commits else 0))
-        _upstream_only_number = paint('red', '-%d' % (_upstream_only_commits.count('\n')
-                                                      if _upstream_only_commits else 0))
-        _str_format = '{0:<%d}{1:<5}{2:<5}' % (branch_name_len)
-        return _str_format.format(branch, _branch_only_number, _upstream_only_number)
-    except: # something wrong with getting the diff info, just use plain paint
+def format_commit_diff(branch, counts, branch_name_len):
+    if counts is None: # something wrong with getting the diff info, just use plain paint
         return branch
+    _branch_only_number = paint('green', '+%d' % counts[0])
+    _upstream_only_number = paint('red', '-%d' % counts[1])
+    _str_format = '{0:<%d}{1:<5}{2:<5}' % (branch_name_len)
+    return _str_format.format(branch, _branch_only_number, _upstream_only_number)
 
-def do_periodical_fetch():
+def get_commit_diff(branch, branch_name_len):
+    return format_commit_diff(branch, get_ahead_behind([branch]).get(branch), branch_name_len)
+
+#register the current repository with the maintenance daemon and make sure it runs,
+#or, given an action, list/stop/remove or show the status of the daemon
+#the [h, m, s] of the times in a core.UpdateTime value like '8:0:0, 20:30:0',
+#None unless every one of them is exactly a valid hour:minute:second
+def parse_update_times(value):
+    _times = []
+    for x in value.split(','):
+        _fields = x.strip().split(':')
+        if len(_fields) != 3 or not all([y.isdigit() for y in _fields]):
+            return None
+        _time = map(int, _fields)
+        if _time[0] > 23 or _time[1] > 59 or _time[2] > 59:
+            return None
+        _times.append(_time)
+    return _times
+
+def do_periodical_fetch(action = ''):
+    if action == 'list':
+        _repos = DAEMON.read('repos')
+        return '\n'.join(['%s  %s' % (x, ', '.join([':'.join(map(str, t)) for t in _repos[x]]))
+                          for x in sorted(_repos)]) or 'no repository is registered'
+    if action == 'stop':
+        if DAEMON.signal(signal.SIGTERM):
+            return 'the background updating process is stopped'
+        return 'the background updating process is not running'
+    if action == 'remove':
+        if DAEMON.unregister(root_path()):
+            return 'the local repository will not be updated any more'
+        return 'the local repository is not updated periodically'
+    if action == 'status':
+        _pid = DAEMON.get_pid()
+        _lines = ['background updating process: ' +
+                  ('running, pid %d' % _pid if _pid else 'not running')]
+        for _repo, _status in sorted(DAEMON.read('status').items()):
+            _lines.append(_repo)
+            if 'next' in _status:
+                _lines.append('    next update: %s' % time.ctime(_status['next']))
+            for _task, x in MaintenanceDaemon.TASKS:
+                if _task in _status:
+                    _lines.append('    last %s: %s, %s' % (_task, time.ctime(_status[_task][0]),
+                                                         _status[_task][1]))
+        return '\n'.join(_lines)
+    if action:
+        exit_with_error("Don't know how to '%s', try list, status, stop or remove" % action)
     try:
         _config = get_local("core.UpdateTime")
-        _periods = [x.split(':') for x in _config.split(', ')]
-        _periods = [map(int, x) for x in _periods]
+        _periods = parse_update_times(_config)
+        if _periods is None:
+            exit_with_error("core.UpdateTime is '%s', it should be times of the day like "
+                            "'8:0:0, 20:30:0' (hour:minute:second)" % _config)
     except ConfigItemMissing:
         print('local repo is updated 00:00:00 every day')
         _periods = [[0, 0, 0]]
         set_local('core.UpdateTime', value = "0:0:0")
-    _tmw = datetime.date.today() + datetime.timedelta(days=1)
-    for h, m, s in _periods:
-        sched = Scheduler()
-        @sched.cron_schedule(year = _tmw.year, month = _tmw.month, day = _tmw.day,
-                             hour = h, minute = m, second = s)
-        def periodical_update():
-            invoke(git.fetch())
-            print(paint('yellow', 'GitTool Notice:') +\
-                  'the local repo has been updated.')
-        sched.start()
-    while True:
-        #quit until the value in the configuration is cleared
-        time.sleep(0.2)
-        pass
+    DAEMON.register(root_path(), _periods)
+    DAEMON.start()
+    return "The local repository will be updated periodically."
 
 def update_local_branch():
     #1. fetch the updates from remote repo
@@ -982,7 +2152,7 @@ def update_local_branch():
     except ConfigItemMissing:
         exit_with_error("config item is missing, please report to the developer so that we can fix it!")
     print("fetching from %s ..." % _remote)
-    print(invoke(git.fetch()))
+    print(invoke(git.fetch_argv()))
     #2. ask for option
     _ans = get_answer(prompt = "fetch completes, shall we Merge or Rebase? (m/R)",
                       default = 'r',
@@ -1003,7 +2173,7 @@ def update_local_branch():
 
 #get a branch list. returns <master branch index>, <branch list>
 def get_branch_list(isremote = False):
-    _cmd = git.branch(lsoption = '-r' if isremote else '')
+    _cmd = git.branch_argv(lsoption = '-r' if isremote else '')
     _branches = split(invoke(_cmd), '\n')
     if _branches is None:
         exit_with_error("seems like there is no branch available...")
@@ -1020,25 +2190,28 @@ def get_branch_list(isremote = False):
 
 #based on git branch, to get the current git branch
 def get_current_branch():
-    _first_line = split(invoke(git.status()), '\n')[0]
-    return split(_first_line)[-1] #last word of the first line is the branch name
+    return REPO.get('branch')
 
 def get_active_branches(first_x = None):
     _active_branches = {}
+    _timestamps = {}
     for b in get_branch_list()[1]:
-        _active_branches[b] = invoke(git.log(num = 1,
-                                             format = '%ci, %cr',
-                                             param = b)).split(',')
-    #sort the result by time, ignoring the 6-char ending time zone, e.g. ' +0800'
+        _commit_time = get_commit_time(b)
+        if _commit_time is None: #e.g. '(no branch)'
+            continue
+        _timestamps[b] = _commit_time[0]
+        _active_branches[b] = [format_iso_date(*_commit_time),
+                               ' ' + relative_date(_commit_time[0])]
+    #sort the result by the commit time
     result = sorted(_active_branches.iteritems(),
-                    key = lambda(k, v): time.strptime(v[0][:-6], '%Y-%m-%d %H:%M:%S'),
+                    key = lambda(k, v): _timestamps[k],
                     reverse = True)
     return result[:first_x]
 
 def is_remote_branch(b):
     #TODO: check if we have network connected.
     _url = get_remote_url()
-    return invoke(git.lsremote(_url, b))
+    return invoke(git.lsremote_argv(_url, b))
 
 #delete a branch
 def delete_branch(branch, type):
@@ -1053,7 +2226,7 @@ def delete_branch(branch, type):
     else: #to delete a local branch
        if branch == get_current_branch():
            return False, 'current branch %s cannot be deleted' % branch
-       _cmd = git.branch(del_branch = branch)
+       _cmd = git.branch_argv(del_branch = branch)
     _tmp = invoke(_cmd)
     if _tmp.startswith(('Deleted', 'warning:')):
         #delete the corresponding config values
@@ -1069,7 +2242,7 @@ def delete_branch(branch, type):
             #delete the corresponding config values
             remove_local(section = 'branch.%s' % branch)
             remove_local(section = 'remote.%s' % branch)
-            return True, invoke(git.branch(force_del_branch = branch))
+            return True, invoke(git.branch_argv(force_del_branch = branch))
         else:
             return False, 'branch %s is not deleted' % branch
     else: # what else is missing?
@@ -1077,12 +2250,14 @@ def delete_branch(branch, type):
 
 #my way to figure out if a branch exist, returns False when a hash is given
 def if_branch_exist(branch):
-    _tmp = invoke(git.showref(branch = branch))
-    return _tmp is not None
+    for _ref in ['refs/heads/%s' % branch, 'refs/remotes/%s' % branch]:
+        if GIT_POOL.check_object(_ref) is not None:
+            return True
+    return False
 
 #-------------------config helppers
 def change_branch():
-    _tmp = invoke(git.config(exp = '^remote\.*'))
+    _tmp = GIT_POOL.find_config('^remote\.*')
     if _tmp == '': # no configure setting available, need to create one
         _url = get_answer(prompt = 'Enter the URL of the remote repository')
         set_local('remote.origin.url', _url)
@@ -1193,7 +2368,7 @@ def get_merge(branch):
 #get the url of the corresponding remote repository
 def get_remote_url():
     try:
-        _remote = get_remote(get_current_branch())
+        _remote = REPO.get('remote')
         _url = get_local('remote.%s.url' % _remote)
         return _url
     except ConfigItemMissing:
@@ -1202,7 +2377,7 @@ def get_remote_url():
 #set the url of the corresponding remote repository
 def set_remote_url(url):
     try:
-        _remote = get_remote(get_current_branch())
+        _remote = REPO.get('remote')
     except ConfigItemMissing:
         exit_with_error("config item is missing,"
                         " please report to the developer so that we can fix it!")
@@ -1210,58 +2385,60 @@ def set_remote_url(url):
 
 #get the remote branch, the merge value in the branch section
 def get_remote_branch(show_remote_path = False):
+    if not show_remote_path: # return the local copy path linked to the remote repo
+        return REPO.get('upstream')
     try:
         #get the name of the corresponding remote branch
-        _current_branch = get_current_branch()
-        _remote_branch = get_local('branch.%s.merge' % _current_branch)
-        if show_remote_path: # return the path in the remote repo
-            # skip the 'remotes' part
-            if _remote_branch.startswith('refs/remotes'):
-                return _remote_branch[:5] + _remote_branch[13:]
-            else:
-                return _remote_branch
-        else: # return the local copy path linked to the remote repo
-            _remote = get_remote(_current_branch)
-            _fetch = get_local('remote.%s.fetch' % _remote)
-            _remote_copy, _local_copy = _fetch.split(':')
-            if '*' in _local_copy: #this is a path with wildcard
-                _remote_copy = _remote_copy.strip('*+')
-                _local_copy = _local_copy.strip('*')
-                return _remote_branch.replace(_remote_copy, _local_copy)
-            else: #this is the exact path to the remote branch
-                return _local_copy
+        _remote_branch = get_local('branch.%s.merge' % get_current_branch())
     except ConfigItemMissing:
         return None
+    # return the path in the remote repo, skip the 'remotes' part
+    if _remote_branch.startswith('refs/remotes'):
+        return _remote_branch[:5] + _remote_branch[13:]
+    else:
+        return _remote_branch
 
 #set the remote branch, the merge value in the branch section
 def set_remote_branch(branch):
     set_local('branch.%s.merge' % get_current_branch(), branch)
 
-#command to get local git config value
+#section and variable names are case-insensitive, 'git config --list' prints them
+#in lower case while the subsection (e.g. a branch name) keeps its case
+def normalize_config_key(element):
+    _first, _sep, _rest = element.partition('.')
+    _middle, _sep2, _last = _rest.rpartition('.')
+    if not _sep2: #there is no subsection
+        return element.lower()
+    return '%s.%s.%s' % (_first.lower(), _middle, _last.lower())
+
+#command to get local git config value, read from the config snapshot
 def get_local(element):
-    _tmp = invoke(git.config(type = 'local', element = element))
-    if not _tmp or "error: invalid key" in _tmp:
+    _tmp = GIT_POOL.get_config('local', element)
+    if _tmp is None:
         raise ConfigItemMissing
     else:
-        return _tmp[:-1]
+        return _tmp
 
+#command to set local git config value, written out when the config queue is flushed
 def set_local(element, value):
-    _tmp = invoke(git.config(type = 'local', element = element, value = value))
+    GIT_POOL.set_config('local', element, value)
+    REPO.update(['git', 'config']) #e.g. the upstream of the branch may change
 
-#command to get global git config value
+#command to get global git config value, read from the config snapshot
 def get_global(element):
-    _tmp = invoke(git.config(type = 'global', element = element))
-    return None if _tmp is None else _tmp[:-1]
+    _tmp = GIT_POOL.get_config('global', element)
+    return '' if _tmp is None else _tmp #git config prints nothing for a missing item
 
 #command to set global git config value
 def set_global(element, value):
-    _tmp = invoke(git.config(type = 'global', element = element, value = value))
+    GIT_POOL.set_config('global', element, value)
 
 def remove_global(section):
-    _tmp = invoke(git.config(type = 'global', section = section))
+    GIT_POOL.remove_config_section('global', section)
 
 def remove_local(section):
-    _tmp = invoke(git.config(type = 'local', section = section, value = ''))
+    GIT_POOL.remove_config_section('local', section)
+    REPO.update(['git', 'config'])
 
 #-------------------functional blocks
 
@@ -1270,68 +2447,93 @@ months = ['Dec', 'Nov', 'Oct', 'Sep', 'Aug', 'Jul',
           'Dec', 'Nov', 'Oct', 'Sep', 'Aug']
 days = ['Sun', 'Sat', 'Fri', 'Thu', 'Wed', 'Tue', 'Mon',
         'Sun', 'Sat', 'Fri', 'Thu', 'Wed', 'Tue']
-def get_activity_distribution(author, time = 'monthly'):
+#the commits of the author in the period, read by a single streaming
+#'git log --numstat' which also provides the changed lines for the file distribution
+def get_activity_distribution(author, interval = 'monthly'):
     _area_dist = ''
     _time_dist = ''
-    # build the time distribution
+    _since = {'monthly': '6 months ago', 'daily': '7 days ago', 'weekly': '5 weeks ago'}[interval]
     # we could validate the user's email by checking "git log --format='%ae',
     # but for performance consideration, we just don't check the email
-    if time == 'monthly':
-        _buff = invoke(git.log(authors=[author], format='%cd %h', param='--since="6 months ago"'))
-        if _buff == '':
+    _proc = invoke_stream(git.log_argv(authors = [author], format = '%x00%ct %cd',
+                                       param = ['--since=%s' % _since, '--numstat']))
+    _commits = [] #(commit time, commit date) of every commit, the latest first
+    def numstat_lines(): #the header of every commit is taken out on the way
+        for line in _proc.stdout:
+            if line.startswith('\0'):
+                _timestamp, _date = line[1:].split(' ', 1)
+                _commits.append((int(_timestamp), _date))
+            elif line.strip():
+                yield line
+    _area_dict = process_git_diff_stat(numstat_lines())
+    _proc.wait()
+    # build the time distribution
+    if interval == 'monthly':
+        if not _commits:
             _time_dist = '0 commits in the recent 6 months'
         else:
-            _list_months = [x.split()[1] for x in _buff.split('\n') if x is not '']
+            _list_months = [x[1].split()[1] for x in _commits]
             _this_month = _list_months[0]
             _index = months.index(_this_month)
             _time_dict = dict((m, _list_months.count(m)) for m in months[_index : _index + 6])
             for m in months[_index : _index + 6]:
                 _time_dist += '%s: %d commits\n    ' % (m, _time_dict[m])
-    elif time == 'daily':
-        _buff = invoke(git.log(authors=[author], format='%cd %h', param='--since="7 days ago"'))
-        if _buff == '':
+    elif interval == 'daily':
+        if not _commits:
             _time_dist = '0 commits in the recent 7 days'
         else:
-            _list_days = [x.split()[0] for x in _buff.split('\n') if x is not '']
+            _list_days = [x[1].split()[0] for x in _commits]
             _today = _list_days[0]
             _index = days.index(_today)
             _time_dict = dict((d, _list_days.count(d)) for d in days[_index : _index + 7])
             for d in days[_index : _index + 7]:
                 _time_dist += '%s: %d commits\n    ' % (d, _time_dict[d])
-    elif time == 'weekly':
-        _buff = ''
-        _week_buff = invoke(git.log(authors=[author], format='%cd %h', param='--since="1 week ago"'))
-        _commits = len(_week_buff.split('\n')) - 1
-        _time_dist += 'This week: %d commits \n    ' % _commits
+    elif interval == 'weekly':
+        _now = int(time.time())
+        _weeks = [0] * 5
+        for _timestamp, _date in _commits:
+            _week = (_now - _timestamp) / (7 * 24 * 3600)
+            if 0 <= _week < 5:
+                _weeks[_week] += 1
+        _time_dist += 'This week: %d commits \n    ' % _weeks[0]
         for w in xrange(1, 5):
-            _since = '--since="%d week ago"' % (w + 1)
-            _until = '--until="%d week ago"' % w
-            _week_buff = invoke(git.log(authors=[author], format='%cd %h', param='%s %s' % (_since, _until)))
-            _commits = len(_week_buff.split('\n')) - 1
-            _time_dist += 'Previous %d week: %d\n    ' % (w, _commits)
-            _buff += _week_buff
+            _time_dist += 'Previous %d week: %d\n    ' % (w, _weeks[w])
     # build the file distribution
+    _area_dist = format_change_distribution(_area_dict, first_x = 5)
+    return _time_dist, _area_dist
+
+#make the table of added/deleted lines out of the result of process_git_diff_stat
+def format_change_distribution(change_dict, first_x = None):
     _change_len = 10 #assume there are at most 9999999999 changes to show
-    first_x = 5
-    _hashes = [x.split()[-1] for x in _buff.split('\n') if x is not '']
-    _changed_files = ''
-    for h in _hashes:
-        _changed_files += invoke(git.diff(selection = '%(hash)s..%(hash)s^ --numstat' % {'hash': h},
-                                 name_only = False))
-    _area_dict = process_git_diff_stat(_changed_files)
-    _longest_name = max([len(x) for x in _area_dict.keys()]) if _area_dict else 0
-    _area_dist = ['%s, %s, %s' % ("Item".center(_longest_name),
+    _longest_name = max([len(x) for x in change_dict.keys()]) if change_dict else 0
+    result = ['%s, %s, %s' % ("Item".center(_longest_name),
                               paint('green', "Added".center(_change_len)),
                               paint('red', "Deleted".center(_change_len)))]
-    _all = sorted(_area_dict.items(), key=lambda x: sum(x[1]), reverse=True)
+    _all = sorted(change_dict.items(), key=lambda x: sum(x[1]), reverse=True)
     for k, v in _all[:first_x]:
-        _area_dist.append("%s, %s, %s" % (k.ljust(_longest_name),
+        result.append("%s, %s, %s" % (k.ljust(_longest_name),
                                      str(v[0]).ljust(_change_len),
                                      str(v[1]).ljust(_change_len)))
-    return _time_dist, _area_dist
+    return result
+
+#parse the output of 'git diff --name-status -z' into status items, e.g. 'M  file'
+#a rename or copy keeps both of its paths, e.g. 'R  old -> new'
+def parse_name_status(raw):
+    _items = []
+    _fields = raw.split('\0')
+    i = 0
+    while i < len(_fields) and _fields[i]:
+        _status = _fields[i][0] #'R100' and 'C75' come with a similarity score
+        if _status in 'RC':
+            _items.append('%s  %s -> %s' % (_status, _fields[i + 1], _fields[i + 2]))
+            i += 3
+        else:
+            _items.append('%s  %s' % (_status, _fields[i + 1]))
+            i += 2
+    return _items
 
+#returns a list of status items and the comparison string
 def do_status(isremote = False, ishash = False, dir = '', compare_str = ''):
-    _cmds, status = list(), ''
     if isremote: #comparing with the remote branch
         #first fetch the latest copy, and compare locally
         print("comparing with the remote repository, please wait...")
@@ -1346,90 +2548,171 @@ def do_status(isremote = False, ishash = False, dir = '', compare_str = ''):
             compare_str = "Unknow"
     elif ishash:
         compare_str = select_hash_range()
+    _paths = ['--', dir] if dir else []
     if compare_str:#with comparison objects specified, use 'git diff'
-        for t in 'ACDMRTUXB':#diff with different diff filter to get the change's type
-            _cmds.append(git.diff(selection = compare_str, type = t))
+        #a single diff gives the change type of every file, renames included
+        _raw, _error = invoke(git.diff_argv(selection = compare_str, name_only = False,
+                                            type = '', param = ['--name-status', '-z'] + _paths),
+                              need_error_and_out = True)
+        if _error.startswith('fatal:'): #something wrong with the given candidate
+            exit_with_error('unknown hash/branch, please check')
+        status = parse_name_status(_raw)
     else:# without comparison objects specified, use 'git status'
-        _cmds.append(git.status(param = '-s'))
-    for c in _cmds:
-        if dir: #only show the touched files in the given directory
-            c += ' -- ' + dir
-        _tmp = invoke(c)
-        _tmp = translate_status_code(c, _tmp)
-        status += _tmp[:_tmp.rfind('\n')] + '\n' if _tmp else ''
-    return status, compare_str
+        _cmd = git.status_argv(param = ['-s'] + _paths)
+        status = split(translate_status_code(' '.join(_cmd), invoke(_cmd)), '\n')
+    return [x for x in status if x], compare_str
 
 def get_file_change_distribution(num_history, first_x = None):
-    _change_len = 10 #assume there are at most 9999999999 changes to show
-    range = 'HEAD%s..HEAD --numstat' % ('~%s' % num_history)
-    _raw = invoke(git.diff(selection = range, name_only = False))
-    #print(_raw)
-    _tmp = process_git_diff_stat(_raw)
-    _longest_name = max([len(x) for x in _tmp.keys()])
-    result = ['%s, %s, %s' % ("Item".center(_longest_name),
-                              paint('green', "Added".center(_change_len)),
-                              paint('red', "Deleted".center(_change_len)))]
-    _all = sorted(_tmp.items(), key=lambda x: sum(x[1]), reverse=True)
-    for k, v in _all[:first_x]:
-        result.append("%s, %s, %s" % (k.ljust(_longest_name),
-                                     str(v[0]).ljust(_change_len),
-                                     str(v[1]).ljust(_change_len)))
-    return result
+    range = 'HEAD%s..HEAD' % ('~%s' % num_history)
+    _raw = invoke(git.diff_argv(selection = range, param = ['--numstat'], name_only = False))
+    return format_change_distribution(process_git_diff_stat(_raw.split('\n')), first_x)
+
+#the repository statistics are kept in .git/gittool/stats, for the history of the
+#commit in 'head' (HEAD when it was last updated):
+#   root_time: commit time of the oldest commit
+#   contributors: {'name\temail': number of commits}
+#   recent: [name, email, numstat lines] of the STATS_RECENT_COMMITS latest commits
+#   version: STATS_VERSION, older files are rebuilt
+def load_repo_stats():
+    import json
+    _path = gittool_file('stats')
+    if _path and os.path.isfile(_path):
+        try:
+            with open(_path) as f:
+                _stats = json.load(f)
+            if _stats.get('version') == STATS_VERSION:
+                return _stats
+        except ValueError: #a broken file, it will be rebuilt
+            pass
+    return {'head': None, 'root_time': None, 'contributors': {}, 'recent': [],
+            'version': STATS_VERSION}
+
+def save_repo_stats(stats):
+    import json
+    _path = gittool_file('stats')
+    if _path is None:
+        return
+    try:
+        with open(_path + '.tmp', 'w') as f:
+            json.dump(stats, f)
+        os.rename(_path + '.tmp', _path)
+    except (IOError, OSError):
+        pass #the statistics will be computed again next time
+
+#bring the repository statistics up to date with HEAD, only the commits added since
+#the last update are read. the statistics are rebuilt from scratch when asked to,
+#or when the last processed commit is no longer in the history of HEAD.
+def get_repo_stats(rebuild = False):
+    global _repo_stats
+    if _repo_stats is not None and not rebuild:
+        return _repo_stats
+    _stats = load_repo_stats()
+    _head = REPO.get('head')
+    if _stats['head'] and not rebuild and _head != _stats['head']:
+        #the old history is still there unless it has been rewritten or HEAD has switched
+        rebuild = _head is None or \
+                  invoke_stream(git.mergebase_argv(param = ['--is-ancestor',
+                                                            _stats['head'], _head])).wait() != 0
+    if rebuild or not _stats['head']:
+        _stats = {'head': None, 'root_time': None, 'contributors': {}, 'recent': [],
+                  'version': STATS_VERSION}
+    if _head and _head != _stats['head']:
+        _range = [_head] + (['^' + _stats['head']] if _stats['head'] else [])
+        #count the new commits per contributor
+        _proc = invoke_stream(git.log_argv(revs = _range, format = '%ct|%aN|%aE'))
+        for line in _proc.stdout:
+            _timestamp, _name, _email = line.rstrip('\n').split('|', 2)
+            _key = '%s\t%s' % (_name, _email)
+            _stats['contributors'][_key] = _stats['contributors'].get(_key, 0) + 1
+            if _stats['root_time'] is None or int(_timestamp) < _stats['root_time']:
+                _stats['root_time'] = int(_timestamp)
+        _proc.wait()
+        #the changed lines of the latest new commits
+        _recent = []
+        _proc = invoke_stream(git.log_argv(revs = _range, num = STATS_RECENT_COMMITS,
+                                           format = '%x00%aN|%aE', param = ['--numstat']))
+        for line in _proc.stdout:
+            if line.startswith('\0'):
+                _name, _email = line[1:].rstrip('\n').split('|', 1)
+                _recent.append([_name, _email, []])
+            elif line.strip():
+                _recent[-1][2].append(line.rstrip('\n'))
+        _proc.wait()
+        _stats['recent'] = (_recent + _stats['recent'])[:STATS_RECENT_COMMITS]
+        _stats['head'] = _head
+        save_repo_stats(_stats)
+    _repo_stats = _stats
+    return _stats
 
 def get_repo_age():
-    _tmp = invoke(git.log(format = '%cr', param = '--reverse'))
-    return re.search('^.+ago', _tmp).group()[:-4] #skip the ' ago'
+    _root_time = get_repo_stats()['root_time']
+    if _root_time is None:
+        return 'unknown'
+    return relative_date(_root_time)[:-4] #skip the ' ago'
 
 def get_active_contributors(first_x = None, recent_commits = None):
     result = []
     total_commit = 0
+    _stats = get_repo_stats()
+    if recent_commits is not None and recent_commits > STATS_RECENT_COMMITS:
+        #more than what the statistics keep, ask git
+        _raw = invoke(git.log_argv(num = recent_commits,
+                                   format = '%aN|%aE'))
+        _recent = [line.split('|') for line in _raw.split('\n') if line]
+    else:
+        _recent = [x[:2] for x in _stats['recent'][:recent_commits]]
     if recent_commits is not None:
-        total_commit = recent_commits
+        total_commit = len(_recent) #the history may be shorter than asked
         _tmp = {}
         #get active contributors in the recent commits
-        _raw = invoke(git.log(num = recent_commits,
-                              format = '%an|<%ae>'))
-        for name, email in [line.split('|') for line in _raw.split('\n') if line]:
+        for name, email in _recent:
             if _tmp.has_key(name):
                 _tmp[name][1] += 1
             else:
-                _tmp[name] = [email, 1]
+                _tmp[name] = ['<%s>' % email, 1]
         result = sorted(_tmp.iteritems(), key = lambda(k, v): v[1], reverse = True)
         if first_x:
             result = result[:first_x]
         for record in result: #convert the commit counts to string
             record[1][1] = str(record[1][1])
     else:
-        _tmp = invoke(git.shortlog(param = '-s -n -e')).split('\n')
-        for line in [x.strip() for x in _tmp[:first_x]]:
-            _commits = re.search('^\d+', line).group()
-            _email = re.search('<.+>', line).group()
-            _name = line[line.find(_commits) + len(_commits): line.find(_email)]
-            result.append([_name.strip(), [_email, _commits]])
-            total_commit += int(_commits)
+        _all = sorted(_stats['contributors'].iteritems(), key = lambda(k, v): v, reverse = True)
+        for _key, _commits in _all[:first_x]:
+            _name, _email = _key.split('\t')
+            result.append([_name, ['<%s>' % _email, str(_commits)]])
+            total_commit += _commits
     return total_commit, result
 
+#the changed lines per directory in the recent commits kept by the statistics
+def get_recent_change_distribution(num_history, first_x = None):
+    _lines = []
+    for _name, _email, _numstat in get_repo_stats()['recent'][:num_history]:
+        _lines += _numstat
+    return format_change_distribution(process_git_diff_stat(_lines), first_x)
+
+#the range is a list of git log arguments, e.g. ['-5', '--', 'file']
 def do_log(range, format):
-    return invoke(git.log(hash = range, format = format, param = '--date=short'))
+    return invoke(git.log_argv(revs = range, format = format, param = ['--date=short']))
 
 def do_log_tag(range):
-    options = '--abbrev-commit --date=short'
-    _cmd = git.log(hash = range, format = '%ad|%an [%ae]|%h|%s|%d', param = options)
-    _logs = split(invoke(_cmd), '\n')[:-1]
+    options = ['--abbrev-commit', '--date=short']
+    _cmd = git.log_argv(revs = range, format = '%H|%ad|%an [%ae]|%h|%s', param = options)
+    _logs = [x for x in split(invoke(_cmd), '\n')[:-1] if '|' in x]
+    #TODO: handle the changed file info here
+    #answer 'which branches/tags contain the commit' for all the commits at once
+    _refs = get_ref_tips()
+    _containers = get_refs_containing([x.split('|')[0] for x in _logs], _refs)
+    _tags_on_commit = {}
+    for _name, _commit in _refs:
+        if _name.startswith('refs/tags/'):
+            _tags_on_commit.setdefault(_commit, []).append(_name[10:])
     _result = ''
     for _line in _logs:
-        if '|' not in _line:
-            #TODO: handle the changed file info here
-            continue
-        [_date, _author, _hash, _comment, _tmp] =\
-                _line.split('|') if _line else ['', '', '', '', '']
-        _tmp = split(_tmp.strip(' ()'), ', ')
-        _branch = get_branches_with_commit(_hash)
-        _container_tags = invoke("git tag --contains %s" % _hash)
-        _container_tags = split(_container_tags, '\n')
+        [_full_hash, _date, _author, _hash, _comment] = _line.split('|', 4)
+        _branch, _container_tags = _containers[_full_hash]
         if _container_tags:
             #the hash has tags attached, get the tags on this specific hash
-            _tags = list(set(_tmp) & set(_container_tags))
+            _tags = sorted(_tags_on_commit.get(_full_hash, []))
             _result += "___\nRev:     %s\nAuthor:  %s\nDate:    %s\nBranch:  %s\nComment: %s\nTags: %s\n" %\
                        (_hash, _author, _date, _branch, _comment, _tags)
         else: #a hash without any tag
@@ -1438,92 +2721,81 @@ def do_log_tag(range):
     return _result
 
 def do_log_author_or_date(ifdate, format, range, authors = []):
-    _options = ''
+    _options = []
     if ifdate: #ask for the date range
         _d_start = get_answer(prompt = "Start Date: ",
                               help = "Enter the start date of the logs, e.g. 2012-12-26")
         _d_end = get_answer(prompt = "End Date: ",
                             help = "Enter the end date of the logs, e.g. 2012-12-26")
         if re.match('^[\s]*[\d]{4}-[\d]{1,2}-[\d]{1,2}[\s]*$', _d_start): #the input is valid
-            _options += ' --after="%s"' % _d_start
+            _options.append('--after=%s' % _d_start.strip())
         if re.match('^[\s]*[\d]{4}-[\d]{1,2}-[\d]{1,2}[\s]*$', _d_end): #the input is valid
-            _options += ' --before="%s"' % _d_end
-        range = 0 #with dates specified, no need for the range
-    return invoke(git.log(hash = range, format = format, authors = authors,
-                           param = '--date=short %s' % _options))
-
-def _remove_unwanted_logs(log, start, end):
-    _list = log.split('\n')
-    _log_pointer = 0
-    _line_index = 0
-    _start_index = _end_index = 0
-    for line in _list:
-        _line_index += 1
-        if line.strip():
-            _blank_line = 0
-            continue
-        else:
-            _blank_line += 1
-            if _blank_line == 2:
-                _log_pointer += 1
-            else:
-                continue
-        if _log_pointer == start - 1:
-            _start_index = _line_index
-        if _log_pointer == end:
-            _end_index = _line_index - 1
-            break;
-    if _start_index == 0 or _end_index == 0:
-        print("oops, parsing the log went wrong")
-        sys.exit()
-    _tmp = _list[:2] + _list[_start_index:_end_index]
-    _result = '\n'.join(_tmp) + '\n}'
-    return _result
+            _options.append('--before=%s' % _d_end.strip())
+        range = [] #with dates specified, no need for the range
+    return invoke(git.log_argv(revs = range, format = format, authors = authors,
+                               param = ['--date=short'] + _options))
 
+_repo_stats = None # the repository statistics loaded by get_repo_stats
 _dot_file = '/tmp/gittool.dot'
+_viewer_pid_file = _dot_file + '.pid' # pid of the xdot.py showing _dot_file
 _svg_file = '/tmp/gittool.dotty.svg'
-commit_index = 0
+#sizes of the commit graph, in points
+_graph_row = 24 # distance between two commits
+_graph_lane = 20 # distance between two lanes
+_graph_margin = 12
+_graph_char = 7 # width of a character of the labels
 
 def do_log_graphic(num, hash_from, hash_to):
     #first get logs from HEAD to hash_from, we will remove the logs after hash_to later
     if num == 0:
-        _range = 'HEAD' + '~%d' % hash_from + '..HEAD' + ' --ancestry-path'
+        _range = 'HEAD' + '~%d' % hash_from + '..HEAD'
     else:
-        _range = 'HEAD' + '~%d' % num + '..HEAD' + ' --ancestry-path'
-    #_format = '"%h" [label="<f0> %h|{<f1> %an|<f2> %cd}"]\n"%h":f0 -> {%p}'
-    _format = """"%h" [label=<<TABLE>
-                            <TR><TD ROWSPAN="2" PORT="f0" BGCOLOR="bisque"> %h</TD>
-                                <TD>%an</TD></TR>
-                            <TR><TD>%cd</TD></TR>
-                            </TABLE>>]\n"%h":f0 -> {%p}
-              """
-    _result = invoke(git.log(hash = _range, format = _format, param = '--date=short'))
-    #link hashes with arrows
-    _result = re.sub('"[a-f0-9]{7}":f0 -> \{[ a-f0-9]+\}', build_merge_arrows, _result)
-    _result = 'digraph G{\nnode [shape=plaintext]\n'\
-            + _result\
-            + '}' #get data ready for dotty
-    global commit_index
-    commit_index = 0
-    _result = re.sub('BGCOLOR="bisque">', fill_commit_index, _result)
-    if num == 0:
-        #we do the dirty trick here to remove the logs from HEAD to hash_to
-        _result = _remove_unwanted_logs(_result, hash_to, hash_from)
-    with open(_dot_file, 'w') as f:
-        f.write(_result)
+        _range = 'HEAD' + '~%d' % num + '..HEAD'
+    _format = '%H%x00%P%x00%h%x00%an%x00%cd'
+    _result = invoke(git.log_argv(revs = [_range], format = _format,
+                                  param = ['--date=short', '--ancestry-path', '--topo-order']))
+    _commits = []
+    for i, line in enumerate([x for x in _result.split('\n') if '\0' in x]):
+        _sha, _parents, _hash, _author, _date = line.split('\0')
+        if num == 0 and not hash_to <= i + 1 <= hash_from:
+            continue #only the logs from hash_to to hash_from are wanted
+        _commits.append((_sha, _parents.split(), '[%d] %s  %s  %s' % (i + 1, _hash, _author, _date)))
+    with open(_dot_file + '.tmp', 'w') as f:
+        f.write(make_commit_graph(_commits))
+    #replace the file at once, so that an open viewer never reads half a graph
+    os.rename(_dot_file + '.tmp', _dot_file)
+    if get_viewer_pid():
+        print("The graph is updated in the open viewer")
+        return ''
     try:
         #make use of xdot.py from http://code.google.com/p/jrfonseca/
-        _cmd = 'xdot.py ' + _dot_file
-        return invoke(_cmd) #show the generated dot file
+        #the graph is laid out already, xdot.py needs not to run Graphviz
+        _cmd = ['xdot.py', '--no-filter', _dot_file]
+        if DEBUG == True: #for debug only
+            print('>>> %s <<<' % ' '.join(_cmd))
+        _viewer = subprocess.Popen(_cmd)
     except OSError:
-        print("Seems like Graphviz has not been installed...")
+        print("Seems like xdot.py (in the support directory) or pygtk is missing...")
         sys.exit()
+    #the viewer reloads the file when it changes, let the next glsg know it is open
+    with open(_viewer_pid_file, 'w') as f:
+        f.write('%d\n' % _viewer.pid)
+    try:
+        _viewer.wait() #show the generated dot file
+    finally:
+        try:
+            os.remove(_viewer_pid_file)
+        except OSError as e: #another glsg may have removed it already
+            import errno
+            if e.errno != errno.ENOENT:
+                raise
+    return ''
 
 def do_rebase(from_ref):
     print("rebasing from %s ..." % from_ref)
-    _stdout = invoke(git.rebase())
+    _stdout = invoke(git.rebase_argv())
     if 'Failed to merge' in _stdout: #need manual merge
-        os.system(git.mergetool())
+        subprocess.call(git.mergetool_argv())
         _tmp = 'Done'
     return _stdout
 
@@ -1540,9 +2812,9 @@ def do_merge(from_ref, to_ref = None):
     print("merging from %s ..." % from_ref)
     if to_ref:#we need to first switch to the to ref
         do_checkout_branch(target = to_ref) #switch to the target branch
-    _tmp = invoke(git.merge(from_ref)) #try auto merge
+    _tmp = invoke(git.merge_argv(from_ref)) #try auto merge
     if 'Automatic merge failed' in _tmp: #need manual merge
-        os.system(git.mergetool())
+        subprocess.call(git.mergetool_argv())
         _tmp = 'Done'
     return _tmp
 
@@ -1552,7 +2824,7 @@ def do_checkout_branch(target, in_list = True, isremote = False, new_branch = ""
         _tmp = do_fetch(ref = target)
     elif in_list: #this is an existing branch
         print("loading branch %s ..." % get_commit_diff(target, len(target) + 3))
-        _tmp = invoke(git.checkout(target = target, new_branch = new_branch))
+        _tmp = invoke(git.checkout_argv(target = target, new_branch = new_branch))
         if new_branch != "":
             set_local("core.CurrentBranch", value = new_branch)
         else:
@@ -1568,7 +2840,7 @@ def do_checkout_branch(target, in_list = True, isremote = False, new_branch = ""
 
 def do_checkout_file_from_commit(files, hash):
     for f in files:
-        invoke(git.checkout(target = '%s %s' % (hash, f)))
+        invoke(git.checkout_argv(target = hash, files = [f]))
 
 def do_checkout_from_commit(ref):
     _new_branch = ''
@@ -1582,9 +2854,9 @@ def do_checkout_from_commit(ref):
     except ConfigItemMissing:
         _track_info = _parent_remote #like origin/maste
     #build and go into the branch
-    _tmp = invoke(git.checkout(target = ref, new_branch = _new_branch))
+    _tmp = invoke(git.checkout_argv(target = ref, new_branch = _new_branch))
     #set the upstream info for the branch
-    _tmp += invoke(git.branch(branch = _new_branch, upstream = _track_info))
+    _tmp += invoke(git.branch_argv(branch = _new_branch, upstream = _track_info))
     if 'fatal: git checkout:' in _tmp: #something wrong occur when checking out
         exit_with_error(_tmp)
     set_local("branch.%s.TrackInfo" % _new_branch, value = _track_info)
@@ -1597,7 +2869,11 @@ def do_patch(hash_str, patch_file):
         _ans = get_answer(prompt = 'Patch the change in these files? [y/N]', default = 'n')
         if _ans.lower() is 'n':
             exit()
-    _tmp = invoke(git.patch(selection = hash_str, patch_file = patch_file))
+    _patch, _error = invoke(git.patch_argv(selection = hash_str), need_error_and_out = True)
+    if _error:
+        exit_with_error(_error)
+    with open(patch_file, 'w') as f:
+        f.write(_patch)
     return '\npatch saved to %s' % patch_file
 
 def do_commit(msg, files_to_save = None):
@@ -1606,13 +2882,12 @@ def do_commit(msg, files_to_save = None):
         print('\n'.join(files_to_save))
         _ans = get_answer(prompt = "save the files above? [y/N]", default = 'n')
         if _ans.lower() == 'y':
-            _files_str = ' '.join(files_to_save)
-            invoke(git.commit(' %s -m "%s"' % (_files_str, msg)))
+            invoke(git.commit_argv(msg, files = files_to_save))
     else:
-        invoke(git.commit(' -a -m "%s"' % msg))
+        invoke(git.commit_argv(msg, param = ['-a']))
 
 def do_apply(file):
-    _tmp = invoke(git.apply(file, check = True))
+    _tmp = invoke(git.apply_argv(file, check = True))
     for line in _tmp.split('\n'):
         if 'does not apply' in line:
             print("Attempt to load the patch failed.")
@@ -1620,19 +2895,19 @@ def do_apply(file):
                               default = 'y')
             if _ans.lower() is 'n':
                 exit()
-    _tmp = invoke(git.apply(file, check = True,
-                            param = '--ignore-space-change --ignore-whitespace'))
+    _tmp = invoke(git.apply_argv(file, check = True,
+                                 param = ['--ignore-space-change', '--ignore-whitespace']))
     for line in _tmp.split('\n'):
         if 'does not apply' in line:
             exit_with_error("Loading the patch failed. Check the patch file")
     print("loading patch file %s ..." % paint('red', file))
-    return invoke(git.apply(file))
+    return invoke(git.apply_argv(file))
 
 def do_fetch(url = None, ref = None):
     #TODO: check if we have network connected.
     if url: #this is only to update the local repo by fetch
         print("updating ...")
-        _result = invoke(git.fetch(url))
+        _result = invoke(git.fetch_argv(url))
     else: #to fetch a remote branch to local repo
         """
         _bname = ref[ ref.rfind('/') + 1: ] #get the branch name
@@ -1652,9 +2927,9 @@ def do_fetch(url = None, ref = None):
         _bname = ref[ ref.rfind('/') + 1: ] #get the branch name
         _local_track = 'remotes/' + ref[ref.find('/') + 1: ]
         print("loading remote branch %s ..." % paint('red', ref))
-        _result = invoke(git.fetch(url = 'origin'))
+        _result = invoke(git.fetch_argv(url = 'origin'))
         #make a branch tracking the ref, forcing the branch name to be the same as the remote
-        _result += invoke(git.checkout(new_branch = _bname, track = _local_track))
+        _result += invoke(git.checkout_argv(new_branch = _bname, track = _local_track))
         set_local("core.CurrentBranch", value = _bname)
         #this is the first branch we check out from a remote branch, remember the track info
         set_local("branch.%s.TrackInfo" % _bname, value = _local_track)
@@ -1672,7 +2947,7 @@ def do_clone():
     if _url not in [x.split()[0] for x in _urls]: #user type in a new item
         add_to_source_list('url', _url)
     print("Cloning %s ..." % _url)
-    invoke(git.clone(_url))
+    invoke(git.clone_argv(_url))
     return "Done"
 
 def do_init():
@@ -1681,8 +2956,8 @@ def do_init():
     _new_files = get_answer(prompt = 'Select the files to be added into the new repository',
                             title = ['File List'],
                             ball = _files)
-    invoke(git.init())
-    invoke(git.add(_new_files))
+    invoke(git.init_argv())
+    invoke(git.add_argv(_new_files))
     #do git commit
     _msg = get_answer(prompt = 'Any comment? [empty comment is not allowed]')
     do_commit(msg = _msg)
@@ -1725,27 +3000,179 @@ def push_to_remote():
         increment_count('url', _url)
         increment_count('ref', _ref)
         set_remote_branch(_ref)  #this doesn't work yet
-    _cmd = git.push(repo = _url, branch = get_current_branch(), ref = _ref)
+    _cmd = git.push_argv(repo = _url, branch = get_current_branch(), ref = _ref)
     _tmp = invoke(_cmd)
     if 'non-fast-forward updates were rejected' in _tmp:
         print(_tmp)
         _ans = get_answer(prompt = 'would you like to force pushing? [y/N]',
                           default = 'N')
         if _ans.lower() == 'y':
-            _cmd = git.push(repo = _url, branch = get_current_branch(),
-                            ref = _ref, param = '--force')
+            _cmd = git.push_argv(repo = _url, branch = get_current_branch(),
+                                 ref = _ref, param = ['--force'])
             return invoke(_cmd)
         else:
             return "done"
     else:
         return _tmp #when the push is ok, return the git command result
 
+#-------------------graph helppers
+#return the pid of the xdot.py showing the commit graph, or None if there is none
+def get_viewer_pid():
+    try:
+        with open(_viewer_pid_file) as f:
+            _pid = int(f.read())
+        #the viewer may have gone without cleaning up, and its pid be given to another process
+        with open('/proc/%d/cmdline' % _pid) as f:
+            _args = f.read().split('\0')
+    except (IOError, ValueError):
+        return None
+    if not any('xdot' in x for x in _args) or _dot_file not in _args:
+        return None
+    return _pid
+
+#place the commits (sha, parents), children before parents, in lanes:
+#every commit goes to the leftmost lane reserved for it by its children, or to a free
+#lane, and reserves its lane for its first parent and free lanes for the others.
+#returns the lane of every commit, the number of lanes used at every row, the edges
+#as (child, parent, lane the edge runs in), and the parents out of the list with their lanes
+def layout_commit_graph(commits):
+    _waiting = {} # sha => lanes reserved for it
+    _free = [] # heap of the lanes given back
+    _active = set() # the lanes in use
+    _lanes = {}
+    _row_width = []
+    _edges = []
+    def _new_lane():
+        _lane = heapq.heappop(_free) if _free else len(_active)
+        _active.add(_lane)
+        return _lane
+    def _free_lane(lane):
+        _active.discard(lane)
+        heapq.heappush(_free, lane)
+    for _sha, _parents in commits:
+        _reserved = _waiting.pop(_sha, [])
+        _lane = min(_reserved) if _reserved else _new_lane()
+        for x in _reserved: #the other branches end here
+            if x != _lane:
+                _free_lane(x)
+        _lanes[_sha] = _lane
+        _row = max(_active) + 1
+        _keep = False
+        for i, p in enumerate(_parents):
+            if i == 0: #the first parent carries on in this lane
+                _to = _lane
+                _keep = True
+                _waiting.setdefault(p, []).append(_to)
+            elif p in _waiting: #the parent has a lane already, join it
+                _to = _waiting[p][0]
+            else:
+                _to = _new_lane()
+                _waiting[p] = [_to]
+            _edges.append((_sha, p, _to))
+        if not _keep:
+            _free_lane(_lane)
+        _row_width.append(max(_row, max(_active) + 1 if _active else 0))
+    _outside = dict([(p, min(l)) for p, l in _waiting.items()])
+    return _lanes, _row_width, _edges, _outside
+
+#the text of a dot attribute holding xdot drawing operations
+def xdot_quote(str):
+    return '"%s"' % str.replace('"', "'").replace('\\', '/')
+
+def xdot_text(x, y, text, color = '#000000'):
+    return 'c %d -%s F 12 7 -Courier T %d %d -1 %d %d -%s ' %\
+           (len(color), color, x, y, len(text) * _graph_char, len(text), text)
+
+def xdot_box(x1, y1, x2, y2, fill = None):
+    _points = '%d %d %d %d %d %d %d %d' % (x1, y1, x2, y1, x2, y2, x1, y2)
+    if fill:
+        return 'C %d -%s c 7 -%s P 4 %s ' % (len(fill), fill, fill, _points)
+    return 'c 7 -#000000 p 4 %s ' % _points
+
+#make the xdot code of the commit graph, positioned by layout_commit_graph so that
+#xdot.py can show it as it is, without running Graphviz to lay it out
+#commits are (sha, parents, label), children before parents
+def make_commit_graph(commits):
+    _lanes, _row_width, _edges, _outside = layout_commit_graph([x[:2] for x in commits])
+    _rows = dict([(x[0], i) for i, x in enumerate(commits)])
+    for _sha, _lane in _outside.items(): #the parents out of the list are shown below
+        _rows[_sha] = len(commits)
+        _lanes[_sha] = _lane
+    _height = (len(commits) + (1 if _outside else 0)) * _graph_row + 2 * _graph_margin
+    _x = lambda lane: _graph_margin + lane * _graph_lane + _graph_lane / 2
+    _y = lambda row: _height - _graph_margin - row * _graph_row - _graph_row / 2
+    _nodes = []
+    _graph_width = 0
+    for i, (_sha, _parents, _label) in enumerate(commits):
+        _label = _label.replace('"', "'").replace('\\', '/')
+        _cx, _cy = _x(_lanes[_sha]), _y(i)
+        _tx = _graph_margin + _row_width[i] * _graph_lane + _graph_margin # after all the lanes
+        _tw = len(_label) * _graph_char
+        _index = _label.split()[0] + ' ' + _label.split()[1] #'[n] <hash>' in bisque
+        _draw = 'C 7 -#0000ff c 7 -#0000ff E %d %d 5 5 ' % (_cx, _cy) +\
+                xdot_box(_tx - 4, _cy - _graph_row / 2 + 3,
+                         _tx + len(_index) * _graph_char + 4, _cy + _graph_row / 2 - 3,
+                         fill = '#ffe4c4')
+        _ldraw = xdot_text(_tx, _cy - 4, _label)
+        #the node covers the dot and its label
+        _nx1, _nx2 = _cx - 6, _tx + _tw
+        _graph_width = max(_graph_width, _nx2 + _graph_margin)
+        _nodes.append('"%s" [pos="%d,%d", width="%.2f", height="%.2f", _draw_=%s, _ldraw_=%s];' %
+                      (_sha, (_nx1 + _nx2) / 2, _cy, (_nx2 - _nx1) / 72.0,
+                       (_graph_row - 4) / 72.0, xdot_quote(_draw), xdot_quote(_ldraw)))
+    for _sha, _lane in _outside.items():
+        _cx, _cy = _x(_lane), _y(_rows[_sha])
+        _draw = 'c 7 -#808080 e %d %d 5 5 ' % (_cx, _cy)
+        _ldraw = xdot_text(_cx + 8, _cy - 4, _sha[:7], color = '#808080')
+        _nodes.append('"%s" [pos="%d,%d", width="%.2f", height="%.2f", _draw_=%s, _ldraw_=%s];' %
+                      (_sha, _cx + 28, _cy, 68 / 72.0, 12 / 72.0,
+                       xdot_quote(_draw), xdot_quote(_ldraw)))
+    _lines = []
+    for _child, _parent, _lane in _edges:
+        #from the parent, up the lane, then into the child; the arrow points to the child
+        _cx, _cy = _x(_lanes[_child]), _y(_rows[_child])
+        _px, _py = _x(_lanes[_parent]), _y(_rows[_parent])
+        _lx = _x(_lane)
+        _points = [(_px, _py)]
+        if _rows[_parent] - _rows[_child] > 1: #run in the lane between the two rows
+            if _lx != _px:
+                _points.append((_lx, _py + _graph_row))
+            if _lx != _cx:
+                _points.append((_lx, _cy - _graph_row))
+        _points.append((_cx, _cy - 6))
+        _points = [x for i, x in enumerate(_points) if i == 0 or x != _points[i - 1]]
+        _pos = ' '.join(['%d,%d' % x for x in _points])
+        _ax, _ay = _points[-1]
+        _draw = 'S 15 -setlinewidth(2) c 7 -#0000ff L %d %s ' %\
+                (len(_points), ' '.join(['%d %d' % x for x in _points]))
+        _hdraw = 'C 7 -#0000ff c 7 -#0000ff P 3 %d %d %d %d %d %d ' %\
+                 (_ax, _ay, _ax - 4, _ay - 8, _ax + 4, _ay - 8)
+        _lines.append('"%s" -> "%s" [pos="%s", _draw_=%s, _hdraw_=%s];' %
+                      (_parent, _child, _pos, xdot_quote(_draw), xdot_quote(_hdraw)))
+    return 'digraph G {\ngraph [bb="0,0,%d,%d"];\n%s\n%s\n}\n' %\
+           (max(_graph_width, 1), _height, '\n'.join(_nodes), '\n'.join(_lines))
+
 #-------------------hash helppers
+#read the committer time of a commit from the cat-file batch process
+#returns (timestamp, timezone offset in seconds), or None if it is not a commit
+def get_commit_time(ref):
+    _obj = GIT_POOL.read_object(ref + '^{commit}')
+    if _obj is None:
+        return None
+    for line in _obj[3].split('\n'):
+        if line.startswith('committer '):
+            _timestamp, _tz = line.split()[-2:]
+            _offset = (int(_tz[1:3]) * 3600 + int(_tz[3:5]) * 60) * (-1 if _tz[0] == '-' else 1)
+            return int(_timestamp), _offset
+        if not line: #end of the commit header
+            break
+    return None
+
 #take two hashes and return a valid hash string based on the age of the hashes
 def ordered_hash_string(h1, h2):
-    _birthday1 = invoke(git.log(hash = h1, num = 1, format = '%ct'))
-    _birthday2 = invoke(git.log(hash = h2, num = 1, format = '%ct'))
-    if int(_birthday1) > int(_birthday2): #h1 is younger than h2
+    _birthday1 = get_commit_time(h1)[0]
+    _birthday2 = get_commit_time(h2)[0]
+    if _birthday1 > _birthday2: #h1 is younger than h2
         return '%s..%s' % (h2, h1)
     else:
         return '%s..%s' % (h1, h2)
@@ -1755,27 +3182,30 @@ def select_hash(hball = None, file = []):
     skip = 0
     hl = None
     if hball is None:
-        _range = "--skip=%d %s " % (skip,
-                                    '-- ' + ' '.join(file) if file else '')
-        _format='%n   Rev:  %h%n   Author:  %an%n   Date:    %cd%n   Comment: %s|'
-        _tmp = do_log(_range, _format)
-        hball = HashBall(blist = _tmp.split('|\n'))
+        _range = ['--skip=%d' % skip] + (['--'] + file if file else [])
+        _format='%n   Rev:  %h%n   Author:  %an%n   Date:    %cd%n   Comment: %s'
+        #the log is streamed, only the first page is read before showing the list
+        _stream = GitLogStream(git.log_argv(revs = _range, format = _format,
+                                            param = ['--date=short', '-z']))
+        hball = HashBall(stream = _stream, since = skip)
     hball.term.reset_window()
     while True:
         _ans = get_answer(title = [' Hash List '], default = '/m', ball = hball, hl = hl,
                           help = '   Enter directly or "/m" for more commits, or\n'
                                  '   "/m <ID>" for further details of the hash, or\n'
-                                 '   "/f <keyword>" to go to matching commits\n')[0]
+                                 '   "/f <keyword>" to go to matching commits\n')
+        if isinstance(_ans, str): #the default answer
+            _ans = [_ans]
+        _ans = _ans[0]
         hl = None
-        if _ans.startswith('/m'): # to show detailed info about a commit
+        if _ans.strip() == '/m': # to load more commits
+            _new = hball.load_more()
+            if _new: #jump to the first newly loaded commit
+                hl = len(hball.blist) - len(_new)
+        elif _ans.startswith('/m'): # to show detailed info about a commit
             _index = int(split(_ans)[-1])
-            print(invoke(git.log(hash = hball[_index], num = 1)))
+            print(invoke(git.log_argv(revs = [hball[_index]], num = 1)))
             raw_input('Press Enter to continue...')
-        elif _ans.startswith('/f'): # to find commits with a keyword
-            if len(_ans.split()) == 1: # /f without keyword will clear the search
-                hball.restore_old_list()
-            else:
-                hball.get_log_index_by_keyword(_ans.split()[1])
         else:
             return _ans, hball
 
@@ -1797,27 +3227,61 @@ def get_hash_change(with_current_hash = False, with_previous_hash = False):
     _hash_str = select_hash_range(with_current_hash = with_current_hash,
                                   with_previous_hash = with_previous_hash)
     #list all changed files
-    _file_list = invoke(git.diff(selection = _hash_str))
+    _file_list = invoke(git.diff_argv(selection = _hash_str))
     return _file_list.strip(' \n'), _hash_str
 
 #get the current hash string
 def get_hashes(num):
-    _hash_str = invoke(git.log(num = num, format = '%h'))
+    _hash_str = invoke(git.log_argv(num = num, format = '%h'))
     return split(_hash_str, '\n')[:-1] #get rid of the last empty line
 
 #check if a hash exists
 def if_hash_exist(ver):
-    _tmp = invoke(git.show(param = ver)).split('\n')[0]
-    if _tmp.startswith('fatal: ') or _tmp.strip() is None:
+    _tmp = GIT_POOL.check_object(ver)
+    if _tmp is None:
         return False
     else:
-        return _tmp
+        return '%s %s' % (_tmp[1], _tmp[0]) #e.g. 'commit <sha1>'
 
 #-------------------path helppers
 #get the root path of the current repository
 def root_path():
-    _tmp = invoke(git.revparse(param = '--show-toplevel'))
-    return None if 'Not a git repository' in _tmp else _tmp.strip(' \n')
+    return REPO.get('toplevel')
+
+#get the absolute path of the .git directory of the current repository
+def git_dir():
+    return REPO.get('gitdir')
+
+#find the .git directory of the repository at path without starting git, following
+#the '.git' file of a linked worktree or a submodule; None when git has to be asked
+#(outside a repository, in a bare one, or with GIT_DIR and the like set)
+def find_git_dir(path):
+    if [x for x in ['GIT_DIR', 'GIT_WORK_TREE', 'GIT_CEILING_DIRECTORIES'] if x in os.environ]:
+        return None
+    while True:
+        _dotgit = os.path.join(path, '.git')
+        if os.path.isfile(os.path.join(_dotgit, 'HEAD')):
+            return _dotgit
+        if os.path.isfile(_dotgit):
+            with open(_dotgit) as f:
+                _line = f.readline().strip()
+            if not _line.startswith('gitdir: '):
+                return None
+            return os.path.normpath(os.path.join(path, _line[len('gitdir: '):]))
+        _parent = os.path.dirname(path)
+        if _parent == path:
+            return None
+        path = _parent
+
+#get the path of a file GitTool keeps in .git/gittool, None if not in a repository
+def gittool_file(name):
+    _dir = git_dir()
+    if _dir is None:
+        return None
+    _dir = os.path.join(_dir, 'gittool')
+    if not os.path.isdir(_dir):
+        os.makedirs(_dir)
+    return os.path.join(_dir, name)
 
 #check if we are at a git repository
 def check_git_path():
@@ -1825,51 +3289,34 @@ def check_git_path():
         exit_with_error("It seems you are not in a git repository...")
 
 #-------------------source helppers
+#the sources are kept by SOURCE_STORE, see SourceStore
 #get the source list length
 def get_source_list_len(source):
-    _len = get_global('sourcelist.%s.length' % source)
-    return int(_len) if _len else 0
+    return len(SOURCE_STORE.get(source))
 
-#read the remembered source list
+#read the remembered source list, as 'item count' strings
 def get_source_list(source):
-    _list = list()
-    for i in range(get_source_list_len(source)):
-        _tmp = get_global('sourcelist.%s.item%d' % (source, (i + 1)))
-        if _tmp is None:
-            ConfigItemMissing.complain()
-        _list.append(_tmp)
-    return _list
+    return ['%s %d' % x for x in SOURCE_STORE.get(source).items()]
 
 def delete_source(source, name):
-    _len = get_global('sourcelist.%s.length' % name)
-    for i in range(int(_len)):
-        _line = get_global('sourcelist.%s.item%d' % (name, i + 1))
-        if _line.split()[0] == source:
-            set_global ('sourcelist.%s.item%d' % (name, i + 1), '')
-            set_global('sourcelist.%s.length' % name, str(int(_len) - 1))
-            return True, '[%s] deleted' % source
+    if SOURCE_STORE.delete(name, source):
+        return True, '[%s] deleted' % source
     return False, '[%s] not deleted' % source
 
 #add a new source into the source list
 def add_to_source_list(type, item):
-    _len = get_source_list_len(type)
-    set_global('sourcelist.%s.item%d' % (type, (_len + 1)), item + ' 0')
-    set_global('sourcelist.%s.length' % type, str(_len + 1))
+    SOURCE_STORE.add(type, item)
 
 #increment the count of a source item
 def increment_count(type, item):
-    _len = get_source_list_len(type)
-    for i in range(1, _len + 1):
-        _tmp = get_global('sourcelist.%s.item%d' % (type, i))
-        if _tmp.split()[0] == item: # find the matching item
-            set_global('sourcelist.%s.item%d' % (type, i),
-                       '%s %d' % (item, int(_tmp.split()[1]) + 1))
-            return
-    exit_with_error("Something is wrong: can't find the souce item!")
+    if item not in SOURCE_STORE.get(type):
+        exit_with_error("Something is wrong: can't find the souce item!")
+    SOURCE_STORE.increment(type, item)
 
 #-------------------file helppers
 def do_file_summary(file):
-    _buff = invoke(git.blame(file = file, param = '--show-stats'))
+    import operator
+    _buff = invoke(git.blame_argv(file = file, param = ['--show-stats']))
     _lines = _buff.split('\n')
     lines = len(_lines) - 4 # there are 4 extra lines other than those of the file
     _contributors = {}
@@ -1890,20 +3337,18 @@ def do_file_summary(file):
 def number_of_changed_files(_hashes = '', _remote_branch = '', _file = ''):
     if _file:
         return 1
-    _tmp = invoke(git.diff(selection = _hashes if _hashes else _remote_branch))
+    _tmp = invoke(git.diff_argv(selection = _hashes if _hashes else _remote_branch))
     return len(split(_tmp, '\n')) - 1
 
-#return list of changed files and a list of untracked files from the output of 'git status -s'
-def get_changed_files(str):
+#return list of changed files and a list of untracked files from the status items
+def get_changed_files(status):
     git_path = root_path()
     cur_path = os.getcwd()
     _changed_files, _untracked_files = [], []
-    if str is not None:
+    if status is not None:
         _changed_pattern = '^[_MDACUT]{1,2}' #modifed/deleted/added/copied/unmerged/type_changed
         _untracked_pattern = '^\?\?.*' #untracked files
-        #print(str)
-        _file_list = split(str, '\n')[:-1]
-        for x in _file_list:
+        for x in status:
             #TODO: FIX THE GIT PATH HERE
             #x = convert_relative_path(x, git_path, cur_path)
             #print(x)
@@ -1913,35 +3358,48 @@ def get_changed_files(str):
 
 #return the number of changed but not commited files
 def num_uncommited_files():
-    _tmp = invoke(git.status(param = '-s -uno'))
+    _tmp = invoke(git.status_argv(param = ['-s', '-uno']))
     _tmp = split(_tmp, '\n')
     return len(_tmp)
 
+#get the paths of a status item, e.g. ['file'] for 'M_ file' or ['old', 'new'] for
+#'R  old -> new', without the quotes git puts around names with unusual characters
+def get_item_paths(item):
+    _paths = item[3:].split(' -> ') if item[0] in 'RC' else [item[3:]]
+    return [x[1:-1].decode('string_escape') if x.startswith('"') else x for x in _paths]
+
 #revert a file given in a file item
 def revert_file_item(item, unused):
-    _file = item[item.rfind(' ') + 1:] #get the real file name
+    _paths = get_item_paths(item)
+    _file = _paths[-1] #the new name of a renamed or copied file
     _remove_from_list = False
     if re.search('^_[MDT]', item):    #not updated
-        invoke(git.checkout(target = _file))
+        invoke(git.checkout_argv(files = [_file]))
+        _remove_from_list = True
+    elif re.search('^[RC]_', item): #unstage both names, bring back the old one and drop the new one
+        for x in _paths:
+            invoke(git.reset_argv(file = x))
+        invoke(git.checkout_argv(files = [_paths[0]]))
+        invoke(['rm', '-f', _file])
         _remove_from_list = True
-    elif re.search('^[MARCD]_', item): #index and worktree are the same, need to reset first
-        invoke(git.reset(file = _file))
-        invoke(git.checkout(target = _file))
+    elif re.search('^[MAD]_', item): #index and worktree are the same, need to reset first
+        invoke(git.reset_argv(file = _file))
+        invoke(git.checkout_argv(files = [_file]))
         _remove_from_list = True
     elif re.search('^UU', item): #this is a corner case i met when pull to a conflict situation
-        invoke(git.reset(file = _file)) # put 'UU' to 'MM'
-        invoke(git.reset(file = _file)) # put 'MM' to ' M'
-        invoke(git.checkout(target = _file)) # clean ' M' eventually
+        invoke(git.reset_argv(file = _file)) # put 'UU' to 'MM'
+        invoke(git.reset_argv(file = _file)) # put 'MM' to ' M'
+        invoke(git.checkout_argv(files = [_file])) # clean ' M' eventually
         #NOTE: when in here we most likely came from a failed merge, so even when reverting all the changes
         #the repository is not yet cleaned, this is because of the existense of .git/MERGE_HEAD.
         #remove the file and everything works (like 'git pull')
         _remove_from_list = True
     elif re.search('^AA', item): #another case introduced possibly by a failed merge
-        invoke(git.reset(file = _file)) # put 'AA' to '_M'
-        invoke(git.checkout(target = _file)) # clean ' M' eventually
+        invoke(git.reset_argv(file = _file)) # put 'AA' to '_M'
+        invoke(git.checkout_argv(files = [_file])) # clean ' M' eventually
         _remove_from_list = True
     elif item.strip().startswith('??'): #the file is out of hash control
-        invoke('rm -fr ' + _file) #so that we could also remove directories
+        invoke(['rm', '-fr', _file]) #so that we could also remove directories
         _remove_from_list = True
     elif item.strip().startswith('*'): #the file status is unknown other than 'changed'
         exit_with_error("don't know how to revert %s" % _file)
@@ -1954,39 +3412,47 @@ def revert_file_item(item, unused):
 def remove_link_file(x):
     _fullpath = sys.argv[0]
     _dir = _fullpath[:_fullpath.rfind('/') + 1]
-    invoke('rm %s' % (_dir + x))
+    invoke(['rm', _dir + x])
 
 #-------------------GLOBAL SETTINGS-------------------
 # Edit the following settings to make GITTool fits your need
 PROMPT_SIGN = ':> ' # unichr(0x263B) will show a smiling face.
+HASH_PAGE_SIZE = 100 # commits read from the log each time the hash list needs more
 DEBUG = True
-COLOR = False if get_global('GitTool.ColorSupport') == 'no' else True
-
-color = dict()
-color['none'] = ''
-if COLOR:
-    color['red'] = '\033[31m'
-    color['green'] = '\033[32m'
-    color['yellow'] = '\033[33m'
-    color['blue'] = '\033[34m'
-    color['magenta'] = '\033[35m'
-    color['lightblue'] = '\033[36m'
-    color['white'] = '\033[37m'
-    color['gray'] = '\033[30m'
-    color['reverse'] = '\033[07m'
-    color['end'] = '\033[00m'
-    color['quote_left'] = color['red']
-    color['quote_right'] = color['end']
-else:
-    color['red'] = ''
-    color['green'] = ''
-    color['yellow'] = ''
-    color['blue'] = ''
-    color['magenta'] = ''
-    color['lightblue'] = ''
-    color['white'] = ''
-    color['gray'] = ''
-    color['reverse'] = ''
-    color['end'] = ''
-    color['quote_left'] = "'"
-    color['quote_right'] = "'"
+AHEAD_BEHIND_JOBS = 8 # rev-list processes to run in parallel when counting commits
+STATS_RECENT_COMMITS = 100 # commits kept by the repository statistics for 'recent' figures
+STATS_VERSION = 2 # bumped when the statistics file changes meaning, older files are rebuilt
+GIT_POOL = GitProcessPool() # long-lived git helpers shared by the whole command
+REPO = RepoContext() # the repository facts probed by the command
+TERM_SESSION = TerminalSession() # keyboard input and size of the terminal
+SOURCE_STORE = SourceStore(os.path.join(os.environ.get('XDG_CONFIG_HOME', '~/.config'),
+                                        'gittool', 'sources')) # the remembered url/ref sources
+DAEMON = MaintenanceDaemon(os.path.join(os.environ.get('XDG_CONFIG_HOME', '~/.config'),
+                                        'gittool', 'daemon')) # the background updating process
+DAEMON_JOBS = 2 # repositories the background updating process works on at once
+DAEMON_JITTER = 300 # seconds an update may be put off, so that they do not all start together
+WATCH_DELAY = 0.2 # seconds the changes are gathered for before gstw updates the list
+WATCH_MAX_PATHS = 256 # changed paths beyond which gstw asks the status of everything
+WATCH_POLL = 5 # seconds between the updates of gstw when the files cannot be watched
+atexit.register(GIT_POOL.close)
+
+#the codes used when the terminal supports colors (GitTool.ColorSupport is not 'no')
+COLOR_CODES = dict()
+COLOR_CODES['none'] = ''
+COLOR_CODES['red'] = '\033[31m'
+COLOR_CODES['green'] = '\033[32m'
+COLOR_CODES['yellow'] = '\033[33m'
+COLOR_CODES['blue'] = '\033[34m'
+COLOR_CODES['magenta'] = '\033[35m'
+COLOR_CODES['lightblue'] = '\033[36m'
+COLOR_CODES['white'] = '\033[37m'
+COLOR_CODES['gray'] = '\033[30m'
+COLOR_CODES['reverse'] = '\033[07m'
+COLOR_CODES['end'] = '\033[00m'
+COLOR_CODES['quote_left'] = COLOR_CODES['red']
+COLOR_CODES['quote_right'] = COLOR_CODES['end']
+#and the ones used otherwise
+PLAIN_CODES = dict([(x, '') for x in COLOR_CODES.keys()])
+PLAIN_CODES['quote_left'] = "'"
+PLAIN_CODES['quote_right'] = "'"
+color = ColorTable()
@@ -0,0 +1,308 @@
+"""
+The resident command server of GitTool and its thin client.
+
+A command started from a terminal first tries to hand itself over to the
+server: it sends its argv, cwd, environment and the name of its tty over a
+Unix socket, forwards the signals it gets, and exits with the status the
+server sends back. The server keeps an interpreter with GitTool already
+imported and forks a child for every command, which takes over the tty and
+runs the command as the process would have done. When there is no server
+(or the command is not run from a terminal) the command runs in-process.
+
+This module is imported before anything else, keep its imports light;
+the socket module is only loaded when there is a server to talk to.
+It also has the start-up timing mode: with GITTOOL_TIMING set a command
+runs in-process and reports on stderr where its start-up time went.
+"""
+import os, sys, marshal, signal, stat, struct, time
+
+SERVER_IDLE = 3600 # seconds the server waits for a command before it quits
+SERVER_SIGNALS = [signal.SIGINT, signal.SIGQUIT, signal.SIGTERM, signal.SIGHUP,
+                  signal.SIGWINCH, signal.SIGCONT] # forwarded by the client to the command
+TIMING_MODULES = 15 # modules listed by the start-up timing report
+
+#$XDG_RUNTIME_DIR, or a directory of our own in /tmp
+def runtime_dir():
+    return os.environ.get('XDG_RUNTIME_DIR') or '/tmp/gittool-%d' % os.getuid()
+
+#the path of the server socket, None if its directory is not ours alone:
+#anybody who may write there could put a socket of theirs in our place
+def socket_path(create = False):
+    _dir = runtime_dir()
+    if create and not os.path.isdir(_dir):
+        try:
+            os.mkdir(_dir, 0700)
+        except OSError:
+            pass #made by somebody else in the meantime, it is checked below
+    try:
+        _stat = os.lstat(_dir)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(_stat.st_mode) or _stat.st_uid != os.getuid() or \
+            _stat.st_mode & 022:
+        return None
+    return os.path.join(_dir, 'gittool-%d.sock' % os.getuid())
+
+#the tty the command runs on, if stdin, stdout and stderr all are that tty
+def get_tty():
+    try:
+        _ttys = set([os.ttyname(x) for x in [0, 1, 2]])
+    except OSError:
+        return None
+    return _ttys.pop() if len(_ttys) == 1 else None
+
+def send_message(sock, data):
+    _data = marshal.dumps(data)
+    sock.sendall(struct.pack('!I', len(_data)) + _data)
+
+def recv_message(sock):
+    _file = sock.makefile('rb')
+    _head = _file.read(4)
+    if len(_head) < 4:
+        return None
+    return marshal.loads(_file.read(struct.unpack('!I', _head)[0]))
+
+#connect to the server, None if it is not running
+def connect():
+    _path = socket_path()
+    try:
+        _stat = os.lstat(_path) if _path else None
+    except OSError:
+        return None
+    if _stat is None or not stat.S_ISSOCK(_stat.st_mode) or _stat.st_uid != os.getuid():
+        return None #no server, or not one of ours
+    import socket
+    _sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        _sock.connect(_path)
+    except socket.error:
+        _sock.close()
+        return None
+    return _sock
+
+#-------------------client
+#run the command in the server, exit with its status;
+#return only if the command is to be run in this process
+def forward(argv):
+    if os.path.basename(argv[0]) == 'gsrv':
+        return #the server is controlled in-process
+    if os.environ.get('GITTOOL_TIMING'):
+        time_imports()
+        return #the start-up of this process is what we want to know about
+    _tty = get_tty()
+    if _tty is None:
+        return
+    _sock = connect()
+    if _sock is None:
+        return
+    try:
+        send_message(_sock, {'argv': argv, 'cwd': os.getcwd(), 'tty': _tty,
+                             'env': dict(os.environ)})
+        _reply = _sock.makefile('rb')
+        _line = _reply.readline().split()
+        if _line[:1] != ['pid']:
+            return #the server has declined, e.g. it is out of date
+        _pid = int(_line[1]) #and the process group of the command
+        def _forward(sig, frame):
+            try:
+                os.killpg(_pid, sig) #the git processes it has started too
+            except OSError:
+                pass
+        def _suspend(sig, frame): #Ctrl-Z: stop the command, then ourselves
+            _forward(signal.SIGSTOP, frame)
+            signal.signal(signal.SIGTSTP, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTSTP)
+            signal.signal(signal.SIGTSTP, _suspend) #continued, e.g. by 'fg'
+            _forward(signal.SIGCONT, frame)
+        for x in SERVER_SIGNALS:
+            signal.signal(x, _forward)
+        signal.signal(signal.SIGTSTP, _suspend)
+        while True:
+            try:
+                _line = _reply.readline().split()
+                break
+            except IOError: #interrupted by a forwarded signal
+                continue
+    finally:
+        _sock.close()
+    sys.exit(int(_line[1]) if _line[:1] == ['exit'] else 1)
+
+#-------------------start-up timing
+#time every module imported from now on, and report at exit the slowest ones
+#(by the time spent in the module itself, not in the modules it imports)
+def time_imports():
+    import __builtin__, atexit
+    _import = __builtin__.__import__
+    _started = time.time()
+    _times = [] #[module, total, self] for every module imported
+    _nested = [0.0] #time spent in the imports done by the ones in progress
+    def _timed_import(name, *args, **kwargs):
+        if name in sys.modules:
+            return _import(name, *args, **kwargs)
+        _nested.append(0.0)
+        _start = time.time()
+        try:
+            return _import(name, *args, **kwargs)
+        finally:
+            _total = time.time() - _start
+            _self = _total - _nested.pop()
+            _nested[-1] += _total
+            _times.append([name, _total, _self])
+    def _report():
+        __builtin__.__import__ = _import
+        _elapsed = time.time() - _started
+        _lines = ['GitTool start-up timing (ms):', '%8s %8s  %s' % ('self', 'total', 'module')]
+        for _name, _total, _self in sorted(_times, key = lambda x: -x[2])[:TIMING_MODULES]:
+            _lines.append('%8.1f %8.1f  %s' % (_self * 1000, _total * 1000, _name))
+        _lines.append('%d modules imported in %.1f ms, %.1f ms in all' %
+                      (len(_times), _nested[0] * 1000, _elapsed * 1000))
+        sys.stderr.write('\n'.join(_lines) + '\n')
+    __builtin__.__import__ = _timed_import
+    atexit.register(_report)
+
+#-------------------server
+#tell whether a source file of the server has changed since it started
+def is_stale(mtimes):
+    for _file, _mtime in mtimes.items():
+        try:
+            if os.stat(_file).st_mtime != _mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+def get_source_mtimes():
+    _mtimes = {}
+    for _module in sys.modules.values():
+        _file = getattr(_module, '__file__', None)
+        if _file and os.path.dirname(os.path.abspath(_file)) == \
+                os.path.dirname(os.path.abspath(__file__)):
+            _file = os.path.splitext(_file)[0] + '.py'
+            if os.path.isfile(_file):
+                _mtimes[_file] = os.stat(_file).st_mtime
+    return _mtimes
+
+#run the command sent by a client, in a forked child
+def run_command(conn, request, main):
+    _tty = os.open(request['tty'], os.O_RDWR | os.O_NOCTTY)
+    for x in [0, 1, 2]:
+        os.dup2(_tty, x)
+    os.close(_tty)
+    os.setpgid(0, 0) #a group of its own, the client signals all of it
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    sys.argv = request['argv']
+    conn.sendall('pid %d\n' % os.getpid())
+    _status = 0
+    try:
+        main()
+    except SystemExit, e:
+        if e.code is None:
+            _status = 0
+        elif isinstance(e.code, int):
+            _status = e.code
+        else:
+            sys.stderr.write('%s\n' % e.code)
+            _status = 1
+    except KeyboardInterrupt:
+        _status = 130
+    except:
+        import traceback
+        traceback.print_exc()
+        _status = 1
+    try:
+        import atexit
+        atexit._run_exitfuncs() #e.g. stop the git helper processes
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        conn.sendall('exit %d\n' % _status)
+        os._exit(_status)
+
+def serve(main):
+    import socket
+    _path = socket_path(create = True)
+    _server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if os.path.exists(_path):
+        os.remove(_path) #left by a server that has died
+    _old_umask = os.umask(0077) #only the user may connect
+    _server.bind(_path)
+    os.umask(_old_umask)
+    _server.listen(16)
+    _server.settimeout(SERVER_IDLE)
+    _mtimes = get_source_mtimes()
+    _started = time.time()
+    _served = 0
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN) #no zombies
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+    try:
+        while True:
+            try:
+                _conn, x = _server.accept()
+            except socket.timeout:
+                break #nobody has used us for a while
+            except socket.error:
+                continue #interrupted by a signal
+            _conn.settimeout(None)
+            _request = recv_message(_conn)
+            if _request is None:
+                _conn.close()
+            elif _request.get('control') == 'stop':
+                _conn.sendall('stopped\n')
+                _conn.close()
+                break
+            elif _request.get('control') == 'status':
+                _conn.sendall('pid %d, up since %s, %d commands served\n' %
+                              (os.getpid(), time.ctime(_started), _served))
+                _conn.close()
+            elif is_stale(_mtimes):
+                _conn.sendall('restart\n') #the client runs the command itself
+                _conn.close()
+                return 'restart'
+            else:
+                _served += 1
+                if os.fork() == 0:
+                    _server.close()
+                    for x in [signal.SIGCHLD, signal.SIGTERM]:
+                        signal.signal(x, signal.SIG_DFL)
+                    run_command(_conn, _request, main)
+                _conn.close()
+    finally:
+        if _server.getsockname() == _path:
+            os.remove(_path)
+        _server.close()
+
+#ask the running server for something, None if there is no server
+def control(what):
+    _sock = connect()
+    if _sock is None:
+        return None
+    try:
+        send_message(_sock, {'control': what})
+        return _sock.makefile('rb').readline().strip()
+    finally:
+        _sock.close()
+
+#start the server in the background, running the commands with main
+def start(main):
+    if control('status'):
+        return False
+    if socket_path(create = True) is None:
+        sys.exit("%s is not a directory of yours alone, the GitTool server cannot "
+                 "be started there" % runtime_dir())
+    _pid = os.fork()
+    if _pid > 0:
+        os.waitpid(_pid, 0)
+        return True
+    os.setsid()
+    if os.fork() > 0:
+        os._exit(0)
+    _null = os.open(os.devnull, os.O_RDWR)
+    for x in [0, 1, 2]:
+        os.dup2(_null, x)
+    try:
+        if serve(main) == 'restart': #GitTool has been updated, load it again
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+    finally:
+        os._exit(0)
@@ -30,6 +30,10 @@ import math
 import colorsys
 import time
 import re
+import array
+import struct
+import ctypes
+import ctypes.util
 
 import gobject
 import gtk
@@ -47,9 +51,12 @@ import pangocairo
 # - http://comix.sourceforge.net/
 
 
-class Pen:
+class Pen(object):
     """Store pen attributes."""
 
+    __slots__ = ('color', 'fillcolor', 'linewidth', 'fontsize', 'fontname',
+                 'dash', 'highlight_pen')
+
     def __init__(self):
         # set default attributes
         self.color = (0.0, 0.0, 0.0, 1.0)
@@ -58,22 +65,36 @@ class Pen:
         self.fontsize = 14.0
         self.fontname = "Times-Roman"
         self.dash = ()
+        self.highlight_pen = None
 
     def copy(self):
         """Create a copy of this pen."""
         pen = Pen()
-        pen.__dict__ = self.__dict__.copy()
+        (pen.color, pen.fillcolor, pen.linewidth,
+         pen.fontsize, pen.fontname, pen.dash) = self.key()
         return pen
 
+    def key(self):
+        """Return the attributes of this pen, to tell equal pens apart."""
+        return (self.color, self.fillcolor, self.linewidth,
+                self.fontsize, self.fontname, self.dash)
+
     def highlighted(self):
-        pen = self.copy()
-        pen.color = (1, 0, 0, 1)
-        pen.fillcolor = (1, .8, .8, 1)
-        return pen
+        if self.highlight_pen is None:
+            pen = self.copy()
+            pen.color = (1, 0, 0, 1)
+            pen.fillcolor = (1, .8, .8, 1)
+            self.highlight_pen = pen
+        return self.highlight_pen
+
 
+class Shape(object):
+    """Abstract base class for all the drawing shapes.
 
-class Shape:
-    """Abstract base class for all the drawing shapes."""
+    Shapes use __slots__, and share their pens, to keep big graphs small.
+    """
+
+    __slots__ = ('pen', )
 
     def __init__(self):
         pass
@@ -82,11 +103,13 @@ class Shape:
         """Draw this shape with the given cairo context"""
         raise NotImplementedError
 
+    def get_bbox(self):
+        """Return the box (x1, y1, x2, y2) this shape draws in."""
+        raise NotImplementedError
+
     def select_pen(self, highlight):
         if highlight:
-            if not hasattr(self, 'highlight_pen'):
-                self.highlight_pen = self.pen.highlighted()
-            return self.highlight_pen
+            return self.pen.highlighted()
         else:
             return self.pen
 
@@ -99,15 +122,27 @@ class TextShape(Shape):
 
     LEFT, CENTER, RIGHT = -1, 0, 1
 
+    __slots__ = ('x', 'y', 'j', 'w', 't', 'layout')
+
     def __init__(self, pen, x, y, j, w, t):
         Shape.__init__(self)
-        self.pen = pen.copy()
+        self.pen = pen
         self.x = x
         self.y = y
         self.j = j
         self.w = w
         self.t = t
 
+    def get_bbox(self):
+        if self.j == self.LEFT:
+            x = self.x
+        elif self.j == self.CENTER:
+            x = self.x - 0.5*self.w
+        else:
+            x = self.x - self.w
+        size = self.pen.fontsize
+        return x, self.y - size, x + self.w, self.y + 0.5*size
+
     def draw(self, cr, highlight=False):
 
         try:
@@ -194,15 +229,20 @@ class TextShape(Shape):
 
 class ImageShape(Shape):
 
+    __slots__ = ('x0', 'y0', 'w', 'h', 'path')
+
     def __init__(self, pen, x0, y0, w, h, path):
         Shape.__init__(self)
-        self.pen = pen.copy()
+        self.pen = pen
         self.x0 = x0
         self.y0 = y0
         self.w = w
         self.h = h
         self.path = path
 
+    def get_bbox(self):
+        return self.x0, self.y0 - self.h, self.x0 + self.w, self.y0
+
     def draw(self, cr, highlight=False):
         cr2 = gtk.gdk.CairoContext(cr)
         pixbuf = gtk.gdk.pixbuf_new_from_file(self.path)
@@ -218,15 +258,22 @@ class ImageShape(Shape):
 
 class EllipseShape(Shape):
 
+    __slots__ = ('x0', 'y0', 'w', 'h', 'filled')
+
     def __init__(self, pen, x0, y0, w, h, filled=False):
         Shape.__init__(self)
-        self.pen = pen.copy()
+        self.pen = pen
         self.x0 = x0
         self.y0 = y0
         self.w = w
         self.h = h
         self.filled = filled
 
+    def get_bbox(self):
+        m = 0.5*self.pen.linewidth
+        return (self.x0 - self.w - m, self.y0 - self.h - m,
+                self.x0 + self.w + m, self.y0 + self.h + m)
+
     def draw(self, cr, highlight=False):
         cr.save()
         cr.translate(self.x0, self.y0)
@@ -247,17 +294,23 @@ class EllipseShape(Shape):
 
 class PolygonShape(Shape):
 
+    __slots__ = ('points', 'filled')
+
     def __init__(self, pen, points, filled=False):
         Shape.__init__(self)
-        self.pen = pen.copy()
+        self.pen = pen
+        # x, y, x, y, ...
         self.points = points
         self.filled = filled
 
+    def get_bbox(self):
+        return points_bbox(self.points, 0.5*self.pen.linewidth)
+
     def draw(self, cr, highlight=False):
-        x0, y0 = self.points[-1]
-        cr.move_to(x0, y0)
-        for x, y in self.points:
-            cr.line_to(x, y)
+        points = self.points
+        cr.move_to(points[-2], points[-1])
+        for i in xrange(0, len(points), 2):
+            cr.line_to(points[i], points[i + 1])
         cr.close_path()
         pen = self.select_pen(highlight)
         if self.filled:
@@ -273,16 +326,22 @@ class PolygonShape(Shape):
 
 class LineShape(Shape):
 
+    __slots__ = ('points', )
+
     def __init__(self, pen, points):
         Shape.__init__(self)
-        self.pen = pen.copy()
+        self.pen = pen
+        # x, y, x, y, ...
         self.points = points
 
+    def get_bbox(self):
+        return points_bbox(self.points, 0.5*self.pen.linewidth)
+
     def draw(self, cr, highlight=False):
-        x0, y0 = self.points[0]
-        cr.move_to(x0, y0)
-        for x1, y1 in self.points[1:]:
-            cr.line_to(x1, y1)
+        points = self.points
+        cr.move_to(points[0], points[1])
+        for i in xrange(2, len(points), 2):
+            cr.line_to(points[i], points[i + 1])
         pen = self.select_pen(highlight)
         cr.set_dash(pen.dash)
         cr.set_line_width(pen.linewidth)
@@ -292,20 +351,24 @@ class LineShape(Shape):
 
 class BezierShape(Shape):
 
+    __slots__ = ('points', 'filled')
+
     def __init__(self, pen, points, filled=False):
         Shape.__init__(self)
-        self.pen = pen.copy()
+        self.pen = pen
+        # x, y, x, y, ...
         self.points = points
         self.filled = filled
 
+    def get_bbox(self):
+        # the curve stays inside the hull of its control points
+        return points_bbox(self.points, 0.5*self.pen.linewidth)
+
     def draw(self, cr, highlight=False):
-        x0, y0 = self.points[0]
-        cr.move_to(x0, y0)
-        for i in xrange(1, len(self.points), 3):
-            x1, y1 = self.points[i]
-            x2, y2 = self.points[i + 1]
-            x3, y3 = self.points[i + 2]
-            cr.curve_to(x1, y1, x2, y2, x3, y3)
+        points = self.points
+        cr.move_to(points[0], points[1])
+        for i in xrange(2, len(points) - 5, 6):
+            cr.curve_to(*points[i:i + 6])
         pen = self.select_pen(highlight)
         if self.filled:
             cr.set_source_rgba(*pen.fillcolor)
@@ -320,14 +383,45 @@ class BezierShape(Shape):
 
 class CompoundShape(Shape):
 
+    __slots__ = ('shapes', 'bbox')
+
     def __init__(self, shapes):
         Shape.__init__(self)
         self.shapes = shapes
+        self.bbox = union_bbox([shape.get_bbox() for shape in shapes])
 
     def draw(self, cr, highlight=False):
         for shape in self.shapes:
             shape.draw(cr, highlight=highlight)
 
+    def get_bbox(self):
+        return self.bbox
+
+
+def points_bbox(points, margin=0):
+    """Return the box around the points, given as x, y, x, y, ..."""
+    xs = points[0::2]
+    ys = points[1::2]
+    if not xs:
+        return None
+    return min(xs) - margin, min(ys) - margin, max(xs) + margin, max(ys) + margin
+
+
+def union_bbox(boxes):
+    boxes = [box for box in boxes if box is not None]
+    if not boxes:
+        return None
+    return (min([box[0] for box in boxes]), min([box[1] for box in boxes]),
+            max([box[2] for box in boxes]), max([box[3] for box in boxes]))
+
+
+def is_visible(bbox, viewport):
+    """Tell whether a shape drawing in bbox shows in the viewport box."""
+    if viewport is None or bbox is None:
+        return True
+    return (bbox[0] <= viewport[2] and viewport[0] <= bbox[2] and
+            bbox[1] <= viewport[3] and viewport[1] <= bbox[3])
+
 
 class Url(object):
 
@@ -353,6 +447,8 @@ class Jump(object):
 class Element(CompoundShape):
     """Base class for graph nodes and edges."""
 
+    __slots__ = ()
+
     def __init__(self, shapes):
         CompoundShape.__init__(self, shapes)
 
@@ -365,6 +461,8 @@ class Element(CompoundShape):
 
 class Node(Element):
 
+    __slots__ = ('x', 'y', 'x1', 'y1', 'x2', 'y2', 'url')
+
     def __init__(self, x, y, w, h, shapes, url):
         Element.__init__(self, shapes)
 
@@ -403,6 +501,8 @@ def square_distance(x1, y1, x2, y2):
 
 class Edge(Element):
 
+    __slots__ = ('src', 'dst', 'points')
+
     def __init__(self, src, dst, points, shapes):
         Element.__init__(self, shapes)
         self.src = src
@@ -419,6 +519,28 @@ class Edge(Element):
         return None
 
 
+class SpatialIndex(object):
+    """Uniform grid over the graph, to find the items around a point without
+    looking at every item."""
+
+    def __init__(self, cell):
+        self.cell = float(cell)
+        self.cells = {}
+
+    def add(self, item, x1, y1, x2, y2):
+        """Add an item covering the box (x1, y1)-(x2, y2).
+
+        Items come back from lookup() in the order they were added."""
+        cell = self.cell
+        for i in xrange(int(math.floor(x1/cell)), int(math.floor(x2/cell)) + 1):
+            for j in xrange(int(math.floor(y1/cell)), int(math.floor(y2/cell)) + 1):
+                self.cells.setdefault((i, j), []).append(item)
+
+    def lookup(self, x, y):
+        cell = self.cell
+        return self.cells.get((int(math.floor(x/cell)), int(math.floor(y/cell))), ())
+
+
 class Graph(Shape):
 
     def __init__(self, width=1, height=1, shapes=(), nodes=(), edges=()):
@@ -430,10 +552,29 @@ class Graph(Shape):
         self.nodes = nodes
         self.edges = edges
 
+        self.build_index()
+
+    def build_index(self):
+        """Index the nodes and the ends of the edges for hit testing."""
+        # make the cells about the size of a node
+        size = 2*Edge.RADIUS
+        if self.nodes:
+            size = max(size, sum([max(node.x2 - node.x1, node.y2 - node.y1)
+                                  for node in self.nodes])/len(self.nodes))
+        self.node_index = SpatialIndex(size)
+        for node in self.nodes:
+            self.node_index.add(node, node.x1, node.y1, node.x2, node.y2)
+        self.edge_index = SpatialIndex(size)
+        r = Edge.RADIUS
+        for edge in self.edges:
+            for x, y in edge.points[:1] + edge.points[-1:]:
+                self.edge_index.add(edge, x - r, y - r, x + r, y + r)
+
     def get_size(self):
         return self.width, self.height
 
-    def draw(self, cr, highlight_items=None):
+    def draw(self, cr, highlight_items=None, viewport=None):
+        """Draw the graph, leaving out what is outside the viewport box."""
         if highlight_items is None:
             highlight_items = ()
         cr.set_source_rgba(0.0, 0.0, 0.0, 1.0)
@@ -442,25 +583,41 @@ class Graph(Shape):
         cr.set_line_join(cairo.LINE_JOIN_MITER)
 
         for shape in self.shapes:
-            shape.draw(cr)
+            if is_visible(shape.get_bbox(), viewport):
+                shape.draw(cr)
         for edge in self.edges:
-            edge.draw(cr, highlight=(edge in highlight_items))
+            if is_visible(edge.bbox, viewport):
+                edge.draw(cr, highlight=(edge in highlight_items))
         for node in self.nodes:
-            node.draw(cr, highlight=(node in highlight_items))
+            if is_visible(node.bbox, viewport):
+                node.draw(cr, highlight=(node in highlight_items))
+
+    def draw_highlight(self, cr, highlight_items, viewport=None):
+        """Draw only the highlighted items, over a drawing of the graph."""
+        cr.set_line_cap(cairo.LINE_CAP_BUTT)
+        cr.set_line_join(cairo.LINE_JOIN_MITER)
+
+        items = [item for item in highlight_items if is_visible(item.bbox, viewport)]
+        for item in items:
+            if isinstance(item, Edge):
+                item.draw(cr, highlight=True)
+        for item in items:
+            if isinstance(item, Node):
+                item.draw(cr, highlight=True)
 
     def get_url(self, x, y):
-        for node in self.nodes:
+        for node in self.node_index.lookup(x, y):
             url = node.get_url(x, y)
             if url is not None:
                 return url
         return None
 
     def get_jump(self, x, y):
-        for edge in self.edges:
+        for edge in self.edge_index.lookup(x, y):
             jump = edge.get_jump(x, y)
             if jump is not None:
                 return jump
-        for node in self.nodes:
+        for node in self.node_index.lookup(x, y):
             jump = node.get_jump(x, y)
             if jump is not None:
                 return jump
@@ -473,24 +630,26 @@ class XDotAttrParser:
     - http://www.graphviz.org/doc/info/output.html#d:xdot
     """
 
+    # a field and the blanks after it
+    token_re = re.compile(r'(\S+)\s*')
+    space_re = re.compile(r'\s*')
+
     def __init__(self, parser, buf):
         self.parser = parser
         self.buf = buf
         self.pos = 0
         
         self.pen = Pen()
+        self.shared_pen = None
         self.shapes = []
 
     def __nonzero__(self):
         return self.pos < len(self.buf)
 
     def read_code(self):
-        pos = self.buf.find(" ", self.pos)
-        res = self.buf[self.pos:pos]
-        self.pos = pos + 1
-        while self.pos < len(self.buf) and self.buf[self.pos].isspace():
-            self.pos += 1
-        return res
+        mo = self.token_re.match(self.buf, self.pos)
+        self.pos = mo.end()
+        return mo.group(1)
 
     def read_number(self):
         return int(self.read_code())
@@ -508,21 +667,33 @@ class XDotAttrParser:
         pos = self.buf.find("-", self.pos) + 1
         self.pos = pos + num
         res = self.buf[pos:self.pos]
-        while self.pos < len(self.buf) and self.buf[self.pos].isspace():
-            self.pos += 1
+        self.pos = self.space_re.match(self.buf, self.pos).end()
         return res
 
     def read_polygon(self):
+        """Read n points into an array of x, y, x, y, ..."""
         n = self.read_number()
-        p = []
-        for i in range(n):
-            x, y = self.read_point()
-            p.append((x, y))
+        p = array.array('d')
+        fields = self.token_re.finditer(self.buf, self.pos)
+        for i in xrange(n):
+            x = int(fields.next().group(1))
+            mo = fields.next()
+            p.extend(self.transform(x, int(mo.group(1))))
+        if n:
+            self.pos = mo.end()
         return p
 
     def read_color(self):
-        # See http://www.graphviz.org/doc/info/attrs.html#k:color
         c = self.read_text()
+        # the same few colors come over and over
+        try:
+            return self.parser.colors[c]
+        except KeyError:
+            color = self.parser.colors[c] = self.parse_color(c)
+            return color
+
+    def parse_color(self, c):
+        # See http://www.graphviz.org/doc/info/attrs.html#k:color
         c1 = c[:1]
         if c1 == '#':
             hex2float = lambda h: float(int(h, 16)/255.0)
@@ -644,16 +815,25 @@ class XDotAttrParser:
     def transform(self, x, y):
         return self.parser.transform(x, y)
 
+    def get_pen(self):
+        """Return the current pen, shared with the shapes drawn with the same pen."""
+        if self.shared_pen is None:
+            self.shared_pen = self.parser.get_pen(self.pen)
+        return self.shared_pen
+
     def handle_color(self, color, filled=False):
+        self.shared_pen = None
         if filled:
             self.pen.fillcolor = color
         else:
             self.pen.color = color
 
     def handle_linewidth(self, linewidth):
+        self.shared_pen = None
         self.pen.linewidth = linewidth
 
     def handle_linestyle(self, style):
+        self.shared_pen = None
         if style == "solid":
             self.pen.dash = ()
         elif style == "dashed":
@@ -662,35 +842,36 @@ class XDotAttrParser:
             self.pen.dash = (2, 4)       # 2pt on, 4pt off
 
     def handle_font(self, size, name):
+        self.shared_pen = None
         self.pen.fontsize = size
         self.pen.fontname = name
 
     def handle_text(self, x, y, j, w, t):
-        self.shapes.append(TextShape(self.pen, x, y, j, w, t))
+        self.shapes.append(TextShape(self.get_pen(), x, y, j, w, t))
 
     def handle_ellipse(self, x0, y0, w, h, filled=False):
         if filled:
             # xdot uses this to mean "draw a filled shape with an outline"
-            self.shapes.append(EllipseShape(self.pen, x0, y0, w, h, filled=True))
-        self.shapes.append(EllipseShape(self.pen, x0, y0, w, h))
+            self.shapes.append(EllipseShape(self.get_pen(), x0, y0, w, h, filled=True))
+        self.shapes.append(EllipseShape(self.get_pen(), x0, y0, w, h))
 
     def handle_image(self, x0, y0, w, h, path):
-        self.shapes.append(ImageShape(self.pen, x0, y0, w, h, path))
+        self.shapes.append(ImageShape(self.get_pen(), x0, y0, w, h, path))
 
     def handle_line(self, points):
-        self.shapes.append(LineShape(self.pen, points))
+        self.shapes.append(LineShape(self.get_pen(), points))
 
     def handle_bezier(self, points, filled=False):
         if filled:
             # xdot uses this to mean "draw a filled shape with an outline"
-            self.shapes.append(BezierShape(self.pen, points, filled=True))
-        self.shapes.append(BezierShape(self.pen, points))
+            self.shapes.append(BezierShape(self.get_pen(), points, filled=True))
+        self.shapes.append(BezierShape(self.get_pen(), points))
 
     def handle_polygon(self, points, filled=False):
         if filled:
             # xdot uses this to mean "draw a filled shape with an outline"
-            self.shapes.append(PolygonShape(self.pen, points, filled=True))
-        self.shapes.append(PolygonShape(self.pen, points))
+            self.shapes.append(PolygonShape(self.get_pen(), points, filled=True))
+        self.shapes.append(PolygonShape(self.get_pen(), points))
 
 
 EOF = -1
@@ -743,7 +924,9 @@ class Scanner:
             return self.symbols.get(c, None), c, pos + 1
 
 
-class Token:
+class Token(object):
+
+    __slots__ = ('type', 'text', 'line', 'col')
 
     def __init__(self, type, text, line, col):
         self.type = type
@@ -819,6 +1002,11 @@ class Lexer:
         return Token(type = type, text = text, line = line, col = col)
 
     def consume(self, text):
+        if '\n' not in text and '\r' not in text and '\t' not in text:
+            # most tokens sit in a line
+            self.col += len(text)
+            return
+
         # update line number
         pos = 0
         for mo in self.newline_re.finditer(text, pos):
@@ -947,13 +1135,14 @@ class DotLexer(Lexer):
         if type == STR_ID:
             text = text[1:-1]
 
-            # line continuations
-            text = text.replace('\\\r\n', '')
-            text = text.replace('\\\r', '')
-            text = text.replace('\\\n', '')
-            
-            # quotes
-            text = text.replace('\\"', '"')
+            if '\\' in text:
+                # line continuations
+                text = text.replace('\\\r\n', '')
+                text = text.replace('\\\r', '')
+                text = text.replace('\\\n', '')
+
+                # quotes
+                text = text.replace('\\"', '"')
 
             # layout engines recognize other escape codes (many non-standard)
             # but we don't translate them here
@@ -1098,8 +1287,19 @@ class XDotParser(DotParser):
         self.edges = []
         self.shapes = []
         self.node_by_name = {}
+        self.pens = {}
+        self.colors = {}
         self.top_graph = True
 
+    def get_pen(self, pen):
+        """Return a copy of the pen, the same copy for equal pens."""
+        key = pen.key()
+        try:
+            return self.pens[key]
+        except KeyError:
+            shared = self.pens[key] = pen.copy()
+            return shared
+
     def handle_graph(self, attrs):
         if self.top_graph:
             try:
@@ -1235,6 +1435,11 @@ class LinearAnimation(Animation):
     def tick(self):
         t = (time.time() - self.started) / self.duration
         self.animate(max(0, min(t, 1)))
+        if t >= 1:
+            # the timeout goes away as we return False
+            self.timeout_id = None
+            self.stop()
+            self.dot_widget.queue_draw()
         return (t < 1)
 
     def animate(self, t):
@@ -1403,6 +1608,102 @@ class ZoomAreaAction(DragAction):
         self.dot_widget.queue_draw()
 
 
+class FileWatcher(object):
+    """Call back when a file has changed.
+
+    Changes come from inotify, and are gathered for a short while so that
+    a burst of writes reloads the file once. Without inotify the file is
+    polled every second.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 02000000
+
+    event_header = struct.Struct('iIII')
+
+    debounce = 200 # milliseconds
+
+    def __init__(self, filename, callback):
+        self.filename = filename
+        self.callback = callback
+        self.fd = None
+        self.source_id = None
+        self.timeout_id = None
+        self.last_stat = self.stat()
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            fd = -1
+        if fd >= 0:
+            # watch the directory, the file may be replaced by a rename
+            dirname = os.path.dirname(os.path.abspath(filename))
+            mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            if libc.inotify_add_watch(fd, dirname, mask) >= 0:
+                self.fd = fd
+                self.source_id = gobject.io_add_watch(fd, gobject.IO_IN, self.on_event)
+            else:
+                os.close(fd)
+        if self.fd is None:
+            self.source_id = gobject.timeout_add(1000, self.on_poll)
+
+    def stat(self):
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size, st.st_ino
+
+    def on_event(self, fd, condition):
+        try:
+            buf = os.read(fd, 65536)
+        except OSError:
+            return True
+        basename = os.path.basename(self.filename)
+        pos = 0
+        while pos + self.event_header.size <= len(buf):
+            wd, mask, cookie, length = self.event_header.unpack_from(buf, pos)
+            pos += self.event_header.size
+            name = buf[pos:pos + length].rstrip('\0')
+            pos += length
+            if name == basename:
+                # wait for the writes to settle
+                if self.timeout_id is not None:
+                    gobject.source_remove(self.timeout_id)
+                self.timeout_id = gobject.timeout_add(self.debounce, self.on_settled)
+        return True
+
+    def on_settled(self):
+        self.timeout_id = None
+        self.check()
+        return False
+
+    def on_poll(self):
+        self.check()
+        return True
+
+    def check(self):
+        current_stat = self.stat()
+        if current_stat is not None and current_stat != self.last_stat:
+            self.last_stat = current_stat
+            self.callback()
+
+    def stop(self):
+        if self.timeout_id is not None:
+            gobject.source_remove(self.timeout_id)
+            self.timeout_id = None
+        if self.source_id is not None:
+            gobject.source_remove(self.source_id)
+            self.source_id = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
 class DotWidget(gtk.DrawingArea):
     """PyGTK widget that draws dot graphs."""
 
@@ -1430,9 +1731,8 @@ class DotWidget(gtk.DrawingArea):
         self.connect("size-allocate", self.on_area_size_allocate)
 
         self.connect('key-press-event', self.on_key_press_event)
-        self.last_mtime = None
-
-        gobject.timeout_add(1000, self.update)
+        self.watcher = None
+        self.last_dotcode = None
 
         self.x, self.y = 0.0, 0.0
         self.zoom_ratio = 1.0
@@ -1441,6 +1741,7 @@ class DotWidget(gtk.DrawingArea):
         self.drag_action = NullAction(self)
         self.presstime = None
         self.highlight = None
+        self.cache = None
 
     def set_filter(self, filter):
         self.filter = filter
@@ -1486,13 +1787,21 @@ class DotWidget(gtk.DrawingArea):
             dialog.destroy()
             return False
         else:
-            if filename is None:
-                self.last_mtime = None
-            else:
-                self.last_mtime = os.stat(filename).st_mtime
+            self.last_dotcode = dotcode
+            self.watch(filename)
             self.openfilename = filename
             return True
 
+    def watch(self, filename):
+        """Follow the changes of the file the graph comes from."""
+        if self.watcher is not None:
+            if self.watcher.filename == filename:
+                return
+            self.watcher.stop()
+            self.watcher = None
+        if filename is not None:
+            self.watcher = FileWatcher(filename, self.on_file_changed)
+
     def set_xdotcode(self, xdotcode):
         #print xdotcode
         parser = XDotParser(xdotcode)
@@ -1508,13 +1817,21 @@ class DotWidget(gtk.DrawingArea):
             except IOError:
                 pass
 
-    def update(self):
-        if self.openfilename is not None:
-            current_mtime = os.stat(self.openfilename).st_mtime
-            if current_mtime != self.last_mtime:
-                self.last_mtime = current_mtime
-                self.reload()
-        return True
+    def on_file_changed(self):
+        filename = self.watcher.filename
+        try:
+            fp = file(filename, 'rt')
+            dotcode = fp.read()
+            fp.close()
+        except IOError:
+            return
+        # a touched file with the same graph needs no parsing
+        if dotcode != self.last_dotcode:
+            self.set_dotcode(dotcode, filename)
+
+    # how much of the graph around the window goes into the cache,
+    # in window sizes on each side
+    CACHE_MARGIN = 0.5
 
     def do_expose_event(self, event):
         cr = self.window.cairo_create()
@@ -1529,19 +1846,78 @@ class DotWidget(gtk.DrawingArea):
         cr.set_source_rgba(1.0, 1.0, 1.0, 1.0)
         cr.paint()
 
-        cr.save()
         rect = self.get_allocation()
+        x1, y1 = self.window2graph(event.area.x, event.area.y)
+        x2, y2 = self.window2graph(event.area.x + event.area.width,
+                                   event.area.y + event.area.height)
+        viewport = (x1, y1, x2, y2)
+        if not self.is_cached(viewport):
+            self.paint_cache(cr, rect)
+
+        # the graph without highlight comes from the cache
+        surface, graph, zoom_ratio, cache_x, cache_y, width, height = self.cache
+        cr.save()
         cr.translate(0.5*rect.width, 0.5*rect.height)
-        cr.scale(self.zoom_ratio, self.zoom_ratio)
-        cr.translate(-self.x, -self.y)
-
-        self.graph.draw(cr, highlight_items=self.highlight)
+        # the cache is stretched while zooming, till it is painted again
+        cr.scale(self.zoom_ratio/zoom_ratio, self.zoom_ratio/zoom_ratio)
+        cr.set_source_surface(surface,
+                              (cache_x - self.x)*zoom_ratio - 0.5*width,
+                              (cache_y - self.y)*zoom_ratio - 0.5*height)
+        cr.paint()
         cr.restore()
 
+        if self.highlight:
+            cr.save()
+            cr.translate(0.5*rect.width, 0.5*rect.height)
+            cr.scale(self.zoom_ratio, self.zoom_ratio)
+            cr.translate(-self.x, -self.y)
+            self.graph.draw_highlight(cr, self.highlight, viewport)
+            cr.restore()
+
         self.drag_action.draw(cr)
 
         return False
 
+    def is_moving(self):
+        return (self.animation.timeout_id is not None or
+                isinstance(self.drag_action, ZoomAction))
+
+    def is_cached(self, viewport):
+        """Tell whether the cache can show the viewport."""
+        if self.cache is None:
+            return False
+        surface, graph, zoom_ratio, cache_x, cache_y, width, height = self.cache
+        if graph is not self.graph:
+            return False
+        if zoom_ratio != self.zoom_ratio and not self.is_moving():
+            return False
+        x1, y1, x2, y2 = viewport
+        return (cache_x - 0.5*width/zoom_ratio <= x1 and
+                x2 <= cache_x + 0.5*width/zoom_ratio and
+                cache_y - 0.5*height/zoom_ratio <= y1 and
+                y2 <= cache_y + 0.5*height/zoom_ratio)
+
+    def paint_cache(self, cr, rect):
+        """Draw the graph around the window into an offscreen surface."""
+        width = max(1, int(rect.width*(1 + 2*self.CACHE_MARGIN)))
+        height = max(1, int(rect.height*(1 + 2*self.CACHE_MARGIN)))
+        surface = cr.get_target().create_similar(cairo.CONTENT_COLOR, width, height)
+        cache_cr = cairo.Context(surface)
+        cache_cr.set_source_rgba(1.0, 1.0, 1.0, 1.0)
+        cache_cr.paint()
+
+        cache_cr.translate(0.5*width, 0.5*height)
+        cache_cr.scale(self.zoom_ratio, self.zoom_ratio)
+        cache_cr.translate(-self.x, -self.y)
+        viewport = (self.x - 0.5*width/self.zoom_ratio,
+                    self.y - 0.5*height/self.zoom_ratio,
+                    self.x + 0.5*width/self.zoom_ratio,
+                    self.y + 0.5*height/self.zoom_ratio)
+        self.graph.draw(pangocairo.CairoContext(cache_cr), viewport=viewport)
+
+        self.cache = (surface, self.graph, self.zoom_ratio,
+                      self.x, self.y, width, height)
+
     def get_current_pos(self):
         return self.x, self.y
 